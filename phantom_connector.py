@@ -16,24 +16,39 @@
 #
 # Phantom imports
 import ast
+import base64
+import bisect
 import bz2
+import contextlib
 import datetime
+import email.utils
+import functools
 import gzip
+import hashlib
+import io
+import itertools
 import json
 import os
 import pathlib
 import random
+import shutil
 import socket
+import sqlite3
 import string
 import tarfile
+import tempfile
+import threading
 import time
 import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from typing import Tuple
 
 import magic
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 from requests.exceptions import SSLError, Timeout
 
 import phantom.app as phantom
@@ -52,17 +67,65 @@ try:
 except Exception:
     from urllib import quote
 
+try:
+    import encryption_helper
+except ImportError:
+    # Platforms without the helper only keep the login session in memory
+    encryption_helper = None
+
 
 def determine_contains(value):
+    try:
+        return list(_determine_contains_cached(value))
+    except TypeError:
+        # unhashable values (e.g. lists or dicts) can not be cached
+        return list(_run_contains_validators(value))
+
+
+@functools.lru_cache(maxsize=DETERMINE_CONTAINS_CACHE_SIZE, typed=True)
+def _determine_contains_cached(value):
+    return _run_contains_validators(value)
+
+
+def _run_contains_validators(value):
+    skipped = _impossible_contains(value)
     valid_contains = list()
     for c, f in list(CONTAINS_VALIDATORS.items()):
+        if c in skipped:
+            continue
         try:
             if f(value):
                 valid_contains.append(c)
         except Exception:
             continue
 
-    return valid_contains
+    return tuple(valid_contains)
+
+
+def _impossible_contains(value):
+    """ Cheap checks ruling out the validators that can never accept the value,
+    every hash is made of a fixed number of hex digits and every IP address has a digit or a colon in it
+    """
+    if not isinstance(value, str):
+        return ()
+
+    skipped = set()
+
+    stripped = value.strip()
+    if len(stripped) not in HASH_LENGTHS or not all(c in string.hexdigits for c in stripped):
+        skipped.update(HASH_CONTAINS)
+
+    if ':' not in value and not any(c.isdigit() for c in value):
+        skipped.update(IP_CONTAINS)
+
+    return skipped
+
+
+@functools.lru_cache(maxsize=None)
+def _get_magic_detectors():
+    """ Loading the magic databases is expensive, so the detectors are created once per process """
+    msooxml_magic_file_path = os.path.join(pathlib.Path(__file__).parent.resolve(), "magic_files", "msooxml")
+    return magic.Magic(mime=True, magic_file=msooxml_magic_file_path), magic.Magic(mime=True)
 
 
 class RetVal3(tuple):
@@ -70,22 +133,356 @@ class RetVal3(tuple):
         return tuple.__new__(RetVal3, (val1, val2, val3))
 
 
+class PhantomClient(object):
+    """ REST client bound to one Phantom instance, the requests go through the HTTP session of the connector """
+
+    def __init__(self, connector, base_uri, local=False):
+        self._connector = connector
+        self.base_uri = base_uri.strip('/')
+        # The local instance is reached with the credentials of the action run instead of the asset ones
+        self.local = local
+
+    def rest_call(self, endpoint, action_result, **kwargs):
+        return self._connector._make_rest_call(endpoint, action_result, ignore_auth=self.local, base_uri=self.base_uri, **kwargs)
+
+    def iter_pages(self, endpoint, action_result, params=None, page_size=0):
+        return self._connector._iter_pages(endpoint, action_result, params=params, page_size=page_size,
+                                           ignore_auth=self.local, base_uri=self.base_uri)
+
+    def post_artifacts(self, action_result, artifacts):
+        return self._connector._post_artifact_chunk(action_result, artifacts, ignore_auth=self.local, base_uri=self.base_uri)
+
+    def post_artifact_chunks(self, action_result, chunks, run_automation):
+        return self._connector._post_artifact_chunks(action_result, chunks, run_automation, ignore_auth=self.local, base_uri=self.base_uri)
+
+
+class RestCallResult(ActionResult):
+    """ Result of one of the concurrent REST calls of an action, keeps its debug data to be merged into the action result """
+
+    def __init__(self):
+        super(RestCallResult, self).__init__()
+        self.debug_data = []
+
+    def add_debug_data(self, debug_data):
+        self.debug_data.append(debug_data)
+
+
+class AhoCorasick(object):
+    """ Aho-Corasick automaton, finds which of a set of patterns occur in a text with a single pass over the text """
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+
+        for idx, pattern in enumerate(patterns):
+            node = 0
+            for char in pattern:
+                child = self._goto[node].get(char)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto[node][char] = child
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(set())
+                node = child
+            self._output[node].add(idx)
+
+        # Breadth first, so that the failure links of the shallower nodes are already known
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] |= self._output[self._fail[child]]
+
+    def search(self, text):
+        """ Returns the indexes of the patterns found in the text """
+        found = set(self._output[0])
+        node = 0
+        for char in text:
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            found |= self._output[node]
+
+        return found
+
+
+class DecidedListIndex(object):
+    """ On-disk index of the content of a custom list, an SQLite database mapping every string value of the list
+    to its (row, column) locations. Exact lookups are keyed reads, the content is only loaded for substring lookups.
+    """
+
+    def __init__(self, path):
+        # Read only, the database is replaced as a whole when the list changes on the server
+        self._db = sqlite3.connect('file:{}?mode=ro'.format(pathlib.Path(path).as_posix()), uri=True, check_same_thread=False)
+        meta = dict(self._db.execute('SELECT key, value FROM meta'))
+        self.modified_time = meta.get('modified_time')
+        self.list_id = json.loads(meta['list_id']) if 'list_id' in meta else None
+
+    @staticmethod
+    def build(path, decided_list, modified_time):
+        """ Write the index of the list to a new database that atomically replaces the one at path """
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        db = sqlite3.connect(tmp_path)
+        try:
+            db.executescript("""
+                CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+                CREATE TABLE rows (rownum INTEGER PRIMARY KEY, row TEXT NOT NULL);
+                CREATE TABLE cells (value TEXT NOT NULL, rownum INTEGER NOT NULL, cid INTEGER NOT NULL);
+            """)
+            content = decided_list.get('content') or []
+            db.executemany('INSERT INTO meta VALUES (?, ?)', [('modified_time', modified_time), ('list_id', json.dumps(decided_list['id']))])
+            db.executemany('INSERT INTO rows VALUES (?, ?)', ((rownum, json.dumps(row)) for rownum, row in enumerate(content)))
+            db.executemany('INSERT INTO cells VALUES (?, ?, ?)', ((value, rownum, cid) for rownum, row in enumerate(content)
+                                                                   for cid, value in enumerate(row) if isinstance(value, str)))
+            # Built once all the cells are in, which is faster than updating it with every insert
+            db.execute('CREATE INDEX cells_value ON cells (value)')
+            db.commit()
+        finally:
+            db.close()
+
+        os.replace(tmp_path, path)
+
+    def lookup(self, values, column_index=None):
+        """ Returns the (row, column, value index) of every cell equal to one of the values, in the order of the list content """
+        value_indexes = {value: value_idx for value_idx, value in enumerate(values)}
+        found = []
+        for start in range(0, len(values), DECIDED_LIST_LOOKUP_BATCH_SIZE):
+            batch = values[start:start + DECIDED_LIST_LOOKUP_BATCH_SIZE]
+            query = 'SELECT rownum, cid, value FROM cells WHERE value IN ({})'.format(', '.join('?' * len(batch)))
+            for rownum, cid, value in self._db.execute(query, batch):
+                if column_index is None or cid == column_index:
+                    found.append((rownum, cid, value_indexes[value]))
+        return sorted(found)
+
+    def get_rows(self, rownums):
+        """ Returns the rows of the list with the given numbers, keyed by row number """
+        rownums = sorted(set(rownums))
+        rows = {}
+        for start in range(0, len(rownums), DECIDED_LIST_LOOKUP_BATCH_SIZE):
+            batch = rownums[start:start + DECIDED_LIST_LOOKUP_BATCH_SIZE]
+            query = 'SELECT rownum, row FROM rows WHERE rownum IN ({})'.format(', '.join('?' * len(batch)))
+            rows.update((rownum, json.loads(row)) for rownum, row in self._db.execute(query, batch))
+        return rows
+
+    def get_content(self):
+        return [json.loads(row) for row, in self._db.execute('SELECT row FROM rows ORDER BY rownum')]
+
+    def close(self):
+        self._db.close()
+
+
+class DeflateBudgetExceeded(Exception):
+    pass
+
+
+class ArtifactReadError(Exception):
+    """ Reading or preparing the artifacts to post failed, as opposed to posting them """
+    pass
+
+
+class DeflateBudget(object):
+    """ Resource limits of a deflate item run, shared by the extraction workers. A limit of 0 means no limit """
+
+    def __init__(self, input_size, max_depth=0, max_bytes=0, max_files=0, max_ratio=0):
+        self.input_size = input_size
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_ratio = max_ratio
+        self.total_bytes = 0
+        self.total_files = 0
+        self._lock = threading.Lock()
+
+    def check_depth(self, depth):
+        if self.max_depth and depth > self.max_depth:
+            raise DeflateBudgetExceeded("the maximum depth of {} nested archives was reached".format(self.max_depth))
+
+    def add_file(self):
+        with self._lock:
+            self.total_files += 1
+            if self.max_files and self.total_files > self.max_files:
+                raise DeflateBudgetExceeded("the maximum of {} extracted files was reached".format(self.max_files))
+
+    def add_bytes(self, count):
+        with self._lock:
+            self.total_bytes += count
+            if self.max_bytes and self.total_bytes > self.max_bytes:
+                raise DeflateBudgetExceeded("the maximum of {} extracted bytes was reached".format(self.max_bytes))
+            if self.max_ratio and self.total_bytes > self.max_ratio * max(self.input_size, 1):
+                raise DeflateBudgetExceeded("the maximum compression ratio of {} was reached".format(self.max_ratio))
+
+
+class AdaptiveLimiter(object):
+    """ AIMD limit of the number of REST requests in flight. The limit grows by about one request
+    per round of requests answered in time, and is halved when the server is slow or overloaded.
+    A max_limit of 0 disables the limiter.
+    """
+
+    def __init__(self, max_limit, latency_threshold=LIMITER_LATENCY_THRESHOLD):
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.latency_threshold = latency_threshold
+        self._in_flight = 0
+        self._last_decrease = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        if not self.max_limit:
+            return
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, latency, overloaded=False):
+        if not self.max_limit:
+            return
+        with self._condition:
+            self._in_flight -= 1
+            if overloaded or latency > self.latency_threshold:
+                # The requests that were already in flight when the server got slow only halve the limit once
+                now = time.time()
+                if now - self._last_decrease > latency:
+                    self.limit = max(1.0, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+
+class RestMetrics(object):
+    """ Latency, status and byte counts of the REST requests, aggregated per method and endpoint template """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    @staticmethod
+    def _new_stats():
+        return {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'buckets': [0] * len(REST_LATENCY_BUCKETS),
+                'status': {}, 'request_bytes': 0, 'response_bytes': 0, 'retries': 0}
+
+    def record(self, method, endpoint, status, seconds, request_bytes, response_bytes, retried=False):
+        with self._lock:
+            stats = self._endpoints.get((method, endpoint))
+            if stats is None:
+                stats = self._endpoints[(method, endpoint)] = self._new_stats()
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            bucket = bisect.bisect_left(REST_LATENCY_BUCKETS, seconds)
+            if bucket < len(REST_LATENCY_BUCKETS):
+                stats['buckets'][bucket] += 1
+            stats['status'][str(status)] = stats['status'].get(str(status), 0) + 1
+            stats['request_bytes'] += request_bytes
+            stats['response_bytes'] += response_bytes
+            stats['retries'] += int(retried)
+
+    def merge(self, other):
+        with other._lock:
+            endpoints = [(key, dict(stats, buckets=list(stats['buckets']), status=dict(stats['status'])))
+                         for key, stats in other._endpoints.items()]
+        with self._lock:
+            for key, other_stats in endpoints:
+                stats = self._endpoints.get(key)
+                if stats is None:
+                    self._endpoints[key] = other_stats
+                    continue
+                for field in ('count', 'seconds', 'request_bytes', 'response_bytes', 'retries'):
+                    stats[field] += other_stats[field]
+                stats['max_seconds'] = max(stats['max_seconds'], other_stats['max_seconds'])
+                stats['buckets'] = [a + b for a, b in zip(stats['buckets'], other_stats['buckets'])]
+                for status, count in other_stats['status'].items():
+                    stats['status'][status] = stats['status'].get(status, 0) + count
+
+    def summary(self):
+        """ The metrics of each endpoint, the endpoints where the most time was spent first """
+        with self._lock:
+            endpoints = sorted(self._endpoints.items(), key=lambda item: item[1]['seconds'], reverse=True)
+            return [{
+                'method': method,
+                'endpoint': endpoint,
+                'count': stats['count'],
+                'status': [{'status': status, 'count': count} for status, count in stats['status'].items()],
+                'retries': stats['retries'],
+                'total_seconds': round(stats['seconds'], 3),
+                'max_seconds': round(stats['max_seconds'], 3),
+                'request_bytes': stats['request_bytes'],
+                'response_bytes': stats['response_bytes'],
+                # Cumulative, like the buckets of a Prometheus histogram
+                'latency_buckets': [{'le': bound, 'count': count} for bound, count in zip(
+                    [str(bound) for bound in REST_LATENCY_BUCKETS] + ['+Inf'], list(itertools.accumulate(stats['buckets'])) + [stats['count']])]
+            } for (method, endpoint), stats in endpoints]
+
+    def to_prometheus(self, labels):
+        """ The metrics in the Prometheus text exposition format, with the given labels on every sample """
+
+        def _labels(**extra):
+            merged = dict(labels, **extra)
+            return ','.join('{0}="{1}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                            for key, value in merged.items())
+
+        lines = []
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+
+            lines.append('# HELP phantom_app_rest_request_duration_seconds Duration of the REST requests')
+            lines.append('# TYPE phantom_app_rest_request_duration_seconds histogram')
+            for (method, endpoint), stats in endpoints:
+                for bound, count in zip(REST_LATENCY_BUCKETS, itertools.accumulate(stats['buckets'])):
+                    lines.append('phantom_app_rest_request_duration_seconds_bucket{{{0}}} {1}'.format(
+                        _labels(method=method, endpoint=endpoint, le=bound), count))
+                lines.append('phantom_app_rest_request_duration_seconds_bucket{{{0}}} {1}'.format(
+                    _labels(method=method, endpoint=endpoint, le='+Inf'), stats['count']))
+                lines.append('phantom_app_rest_request_duration_seconds_sum{{{0}}} {1}'.format(
+                    _labels(method=method, endpoint=endpoint), stats['seconds']))
+                lines.append('phantom_app_rest_request_duration_seconds_count{{{0}}} {1}'.format(
+                    _labels(method=method, endpoint=endpoint), stats['count']))
+
+            lines.append('# HELP phantom_app_rest_requests_total REST requests by status, or by error for the requests without a response')
+            lines.append('# TYPE phantom_app_rest_requests_total counter')
+            for (method, endpoint), stats in endpoints:
+                for status, count in sorted(stats['status'].items()):
+                    lines.append('phantom_app_rest_requests_total{{{0}}} {1}'.format(
+                        _labels(method=method, endpoint=endpoint, status=status), count))
+
+            for name, field, description in (('request_bytes', 'request_bytes', 'Bytes sent in the REST request bodies'),
+                                             ('response_bytes', 'response_bytes', 'Bytes received in the REST response bodies'),
+                                             ('retries', 'retries', 'REST requests that were sent again')):
+                lines.append('# HELP phantom_app_rest_{0}_total {1}'.format(name, description))
+                lines.append('# TYPE phantom_app_rest_{0}_total counter'.format(name))
+                for (method, endpoint), stats in endpoints:
+                    lines.append('phantom_app_rest_{0}_total{{{1}}} {2}'.format(name, _labels(method=method, endpoint=endpoint), stats[field]))
+
+        return '\n'.join(lines) + '\n'
+
+
 class PhantomConnector(BaseConnector):
 
-    def _validate_integer(self, action_result, parameter, key, allow_zero=False):
+    def _validate_integer(self, action_result, parameter, key, allow_zero=False, err_msg=PHANTOM_ERR_INVALID_INT):
         if parameter is not None:
             try:
                 if not float(parameter).is_integer():
-                    return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_INVALID_INT.format(msg="", param=key)), None
+                    return action_result.set_status(phantom.APP_ERROR, err_msg.format(msg="", param=key)), None
 
                 parameter = int(parameter)
             except Exception:
-                return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_INVALID_INT.format(msg="", param=key)), None
+                return action_result.set_status(phantom.APP_ERROR, err_msg.format(msg="", param=key)), None
 
             if parameter < 0:
-                return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_INVALID_INT.format(msg="non-negative", param=key)), None
+                return action_result.set_status(phantom.APP_ERROR, err_msg.format(msg="non-negative", param=key)), None
             if not allow_zero and parameter == 0:
-                return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_INVALID_INT.format(msg="non-zero positive", param=key)), None
+                return action_result.set_status(phantom.APP_ERROR, err_msg.format(msg="non-zero positive", param=key)), None
 
         return phantom.APP_SUCCESS, parameter
 
@@ -169,16 +566,47 @@ class PhantomConnector(BaseConnector):
                 action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_SERVER.format(response.status_code,
                     self._get_error_details(resp_json))), response, None)
 
+    def _add_debug_data(self, response, action_result, failed):
+        """ Store the response in the debug data of the action result, it will get dumped in the logs if an error occurs.
+        How much of the response is kept is controlled by the debug_capture asset configuration parameter.
+        """
+        if not hasattr(action_result, 'add_debug_data'):
+            return
+
+        policy = self._debug_capture
+
+        if policy == DEBUG_CAPTURE_OFF:
+            return
+
+        if policy == DEBUG_CAPTURE_ERRORS_ONLY and not failed:
+            return
+
+        if policy == DEBUG_CAPTURE_SAMPLED and not failed and random.random() * 100 >= self._debug_capture_sample_rate:
+            return
+
+        if response is None:
+            action_result.add_debug_data({'r_text': 'response is None'})
+            return
+
+        if policy == DEBUG_CAPTURE_TRUNCATED and len(response.content) > self._debug_capture_max_bytes:
+            r_text = '{0}... [truncated, {1} bytes in total]'.format(
+                response.content[:self._debug_capture_max_bytes].decode('utf-8', 'replace'), len(response.content))
+        else:
+            r_text = response.text
+
+        action_result.add_debug_data({'r_text': r_text})
+        action_result.add_debug_data({'r_headers': response.headers})
+        action_result.add_debug_data({'r_status_code': response.status_code})
+
     def _process_response(self, response, action_result):
 
-        # store the r_text in debug data, it will get dumped in the logs if an error occurs
-        if hasattr(action_result, 'add_debug_data'):
-            if response is not None:
-                action_result.add_debug_data({'r_text': response.text})
-                action_result.add_debug_data({'r_headers': response.headers})
-                action_result.add_debug_data({'r_status_code': response.status_code})
-            else:
-                action_result.add_debug_data({'r_text': 'response is None'})
+        ret_val = self._process_response_content(response, action_result)
+
+        self._add_debug_data(response, action_result, phantom.is_fail(ret_val[0]))
+
+        return ret_val
+
+    def _process_response_content(self, response, action_result):
 
         # There are just too many differences in the response to handle all of them in the same function
         if (('json' in response.headers.get('Content-Type', '')) or ('javascript' in response.headers.get('Content-Type'))):
@@ -197,7 +625,11 @@ class PhantomConnector(BaseConnector):
 
         return RetVal3(action_result.set_status(phantom.APP_ERROR, message), response, None)
 
-    def _make_rest_call(self, endpoint, action_result, headers=None, params=None, data=None, method="get", ignore_auth=False):
+    def _make_rest_call(self, endpoint, action_result, headers=None, params=None, data=None, method="get", ignore_auth=False,
+                        base_uri=None, body=None, stream=False):
+        """ body: raw request body, e.g. a generator of bytes to upload a large payload without building it in memory.
+        stream: return the response of a successful request unread, the caller is responsible for closing it.
+        """
 
         config = self.get_config()
 
@@ -221,42 +653,302 @@ class PhantomConnector(BaseConnector):
         if 'Content-Type' not in headers:
             headers.update({'Content-Type': 'application/json'})
 
-        request_func = getattr(requests, method)
+        request_func = getattr(self._session, method, None)
 
         if not request_func:
-            action_result.set_status(phantom.APP_ERROR, "Unsupported HTTP method '{0}' requested".format(method))
+            return RetVal3(action_result.set_status(phantom.APP_ERROR, "Unsupported HTTP method '{0}' requested".format(method)), None, None)
 
         auth = self._auth
 
         # To avoid '//' in the URL(due to self._base_uri + endpoint)
         self._base_uri = self._base_uri.strip('/')
+        base_uri = base_uri.strip('/') if base_uri else self._base_uri
 
         if ignore_auth:
             auth = None
             if 'ph-auth-token' in headers:
                 del headers['ph-auth-token']
 
+        # Large JSON payloads are sent compressed to the configured server, if it has been set up to accept them
+        if self._gzip_requests and data is not None and body is None and method in ('post', 'put') and base_uri == self._base_uri:
+            payload = json.dumps(data).encode('utf-8')
+            if len(payload) >= self._gzip_min_size:
+                body = gzip.compress(payload, compresslevel=GZIP_COMPRESS_LEVEL)
+                data = None
+                headers['Content-Encoding'] = 'gzip'
+
+        # A streamed body is consumed by the first attempt
+        replayable = body is None or isinstance(body, bytes)
+
+        # Only the requests that can be sent again without side effects are retried
+        retryable = method in RETRY_METHODS and replayable
+        url = '{0}{1}'.format(base_uri, endpoint)
+
+        # The session replaces the basic auth of the configured server, the local instance is reached without it
+        use_session_auth = self._session_auth and auth is not None and base_uri == self._base_uri
+        session_cookies = None
+        reauthenticated = False
+
+        for attempt in itertools.count():
+            if use_session_auth:
+                session_cookies = self._get_session_cookies(action_result)
+                if session_cookies is None:
+                    return RetVal3(action_result.get_status(), None, None)
+                auth = None
+                headers['X-CSRFToken'] = session_cookies['csrftoken']
+                headers['Referer'] = '{0}/'.format(self._base_uri)
+
+            self._limiter.acquire()
+            start_time = time.time()
+            try:
+                response = request_func(url,
+                        auth=auth,
+                        cookies={key: session_cookies[key] for key in ('sessionid', 'csrftoken')} if session_cookies else None,
+                        json=data,
+                        data=body,
+                        headers=headers if headers else None,
+                        verify=False if ignore_auth else self._verify_cert,
+                        params=params,
+                        stream=stream,
+                        timeout=TIMEOUT)
+
+            except Timeout as e:
+                retry = retryable and attempt < self._max_retries
+                self._request_done(method, endpoint, start_time, status='timeout', overloaded=True, retry=retry)
+                if retry:
+                    self._wait_before_retry(attempt)
+                    continue
+                return RetVal3(action_result.set_status(phantom.APP_ERROR,
+                            "Request timed out: {}".format(self._get_error_message_from_exception(e))), None, None)
+            except SSLError as e:
+                self._request_done(method, endpoint, start_time, status='ssl_error')
+                return (action_result.set_status(phantom.APP_ERROR,
+                            "HTTPS SSL validation failed: {}".format(self._get_error_message_from_exception(e))), None, None)
+            except Exception as e:
+                retry = retryable and attempt < self._max_retries and isinstance(e, requests.ConnectionError)
+                self._request_done(method, endpoint, start_time, status='connection_error', retry=retry)
+                if retry:
+                    self._wait_before_retry(attempt)
+                    continue
+                return (action_result.set_status(phantom.APP_ERROR,
+                            "Error connecting to server. Error Details: {}".format(self._get_error_message_from_exception(e))), None, None)
+
+            overloaded = response.status_code in RETRY_STATUS_CODES
+            # The session expired or was logged out on the server, log in again once and resend the request
+            reauthenticate = use_session_auth and response.status_code == 401 and not reauthenticated and replayable
+            retry = reauthenticate or (overloaded and retryable and attempt < self._max_retries)
+            self._request_done(method, endpoint, start_time, response=response, overloaded=overloaded, retry=retry, stream=stream)
+
+            if reauthenticate:
+                reauthenticated = True
+                response.close()
+                self._invalidate_session_cookies(session_cookies)
+                continue
+
+            if not retry:
+                break
+
+            self._wait_before_retry(attempt, response.headers.get('Retry-After'))
+            response.close()
+
+        if stream and 200 <= response.status_code < 399:
+            return RetVal3(phantom.APP_SUCCESS, response, None)
+
+        return self._process_response(response, action_result)
+
+    def _login(self, action_result):
+        """ Exchange the username and password for a session of the configured server, returns the session cookies or None """
+        login_url = '{0}/login'.format(self._base_uri)
         try:
-            url = '{0}{1}'.format(self._base_uri, endpoint)
-            response = request_func(url,
-                    auth=auth,
-                    json=data,
-                    headers=headers if headers else None,
-                    verify=False if ignore_auth else self._verify_cert,
-                    params=params,
-                    timeout=TIMEOUT)
-
-        except Timeout as e:
-            return RetVal3(action_result.set_status(phantom.APP_ERROR,
-                        "Request timed out: {}".format(self._get_error_message_from_exception(e))), None, None)
-        except SSLError as e:
-            return (action_result.set_status(phantom.APP_ERROR,
-                        "HTTPS SSL validation failed: {}".format(self._get_error_message_from_exception(e))), None, None)
+            r = self._session.get(login_url, verify=self._verify_cert, timeout=TIMEOUT)
+            csrftoken = r.cookies['csrftoken']
+
+            data = dict()
+            data['username'] = self._auth[0]
+            data['password'] = self._auth[1]
+            data['csrfmiddlewaretoken'] = csrftoken
+
+            headers = dict()
+            headers['Referer'] = login_url
+
+            r2 = self._session.post(login_url, verify=self._verify_cert, data=data, headers=headers, cookies={'csrftoken': csrftoken},
+                                    timeout=TIMEOUT, allow_redirects=False)
+            session_cookie = next((cookie for cookie in r2.cookies if cookie.name == 'sessionid'), None)
+            if session_cookie is None:
+                action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_SESSION_LOGIN.format("please check the username and password"))
+                return None
         except Exception as e:
-            return (action_result.set_status(phantom.APP_ERROR,
-                        "Error connecting to server. Error Details: {}".format(self._get_error_message_from_exception(e))), None, None)
+            action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_SESSION_LOGIN.format(self._get_error_message_from_exception(e)))
+            return None
 
-        return self._process_response(response, action_result)
+        return {
+            'server': self._base_uri,
+            'username': self._auth[0],
+            'sessionid': session_cookie.value,
+            # The CSRF token is rotated on login
+            'csrftoken': r2.cookies.get('csrftoken', csrftoken),
+            'expires': session_cookie.expires or int(time.time()) + DEFAULT_SESSION_LIFETIME
+        }
+
+    def _get_session_cookies(self, action_result):
+        """ Returns the cookies of the session of the configured server, logging in if there is no valid session """
+        with self._session_auth_lock:
+            session_cookies = self._session_cookies
+            if session_cookies and session_cookies['expires'] > time.time() + SESSION_EXPIRY_MARGIN:
+                return session_cookies
+
+            session_cookies = self._login(action_result)
+            if session_cookies is None:
+                return None
+
+            self._session_cookies = session_cookies
+            # The session is kept encrypted in the state, so the next action runs do not have to log in again
+            if encryption_helper is not None:
+                with self._state_lock:
+                    self._state[SESSION_AUTH_STATE_KEY] = self._encrypt_session_cookies(session_cookies)
+            return session_cookies
+
+    def _encrypt_session_cookies(self, session_cookies):
+        asset_id = self.get_asset_id()
+        return dict(session_cookies, **{key: encryption_helper.encrypt(session_cookies[key], asset_id) for key in SESSION_AUTH_SECRET_KEYS})
+
+    def _decrypt_session_cookies(self, session_cookies):
+        asset_id = self.get_asset_id()
+        return dict(session_cookies, **{key: encryption_helper.decrypt(session_cookies[key], asset_id) for key in SESSION_AUTH_SECRET_KEYS})
+
+    def _invalidate_session_cookies(self, session_cookies):
+        with self._session_auth_lock:
+            # Another request might have logged in again already
+            if self._session_cookies is session_cookies:
+                self._session_cookies = None
+
+    def _load_session_auth(self, config):
+
+        self._session_auth = config.get('session_auth', False) and self._auth is not None
+        self._session_auth_lock = threading.Lock()
+        self._session_cookies = None
+
+        session_cookies = self._state.pop(SESSION_AUTH_STATE_KEY, None)
+        if not self._session_auth or not session_cookies or encryption_helper is None:
+            return
+
+        # A session of another server or user is not reused
+        if session_cookies.get('server') != self._base_uri or session_cookies.get('username') != self._auth[0]:
+            return
+
+        try:
+            self._session_cookies = self._decrypt_session_cookies(session_cookies)
+        except Exception as e:
+            # The entry is dropped, the next request logs in again
+            self.debug_print("Unable to decrypt the stored session: {0}".format(self._get_error_message_from_exception(e)))
+            return
+
+        self._state[SESSION_AUTH_STATE_KEY] = session_cookies
+
+    def _request_done(self, method, endpoint, start_time, response=None, status=None, overloaded=False, retry=False, stream=False):
+        """ Account for an attempt of a REST request, in the concurrency limiter and in the metrics of the action """
+        latency = time.time() - start_time
+        self._limiter.release(latency, overloaded=overloaded)
+
+        if getattr(self, '_metrics', None) is None:
+            return
+
+        request_bytes = response_bytes = 0
+        if response is not None:
+            status = response.status_code
+            request_body = getattr(response.request, 'body', None) if hasattr(response, 'request') else None
+            if isinstance(request_body, (bytes, str)):
+                request_bytes = len(request_body)
+            # The size on the wire, the content of a streamed response is left for the caller to read
+            if 'Content-Length' in response.headers:
+                response_bytes = int(response.headers['Content-Length'])
+            elif not stream:
+                response_bytes = len(response.content)
+
+        self._metrics.record(method.upper(), self._get_endpoint_template(endpoint), status, latency, request_bytes, response_bytes, retry)
+
+    @staticmethod
+    def _get_endpoint_template(endpoint):
+        """ The endpoint without its query and with the ids and names in its path replaced by placeholders """
+        segments = endpoint.split('?', 1)[0].split('/')
+        for i, segment in enumerate(segments):
+            if segment.isdigit():
+                segments[i] = '{id}'
+            elif segment and i and segments[i - 1] == 'decided_list':
+                segments[i] = '{name}'
+        return '/'.join(segments)
+
+    def _get_retry_delay(self, attempt, retry_after=None):
+        """ Seconds to wait before the next attempt, the Retry-After header of the server wins over the exponential backoff """
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = (email.utils.parsedate_to_datetime(retry_after) - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0), RETRY_MAX_DELAY)
+
+        # Full jitter, so the clients that were turned away together do not come back together
+        return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+    def _wait_before_retry(self, attempt, retry_after=None):
+        delay = self._get_retry_delay(attempt, retry_after)
+        self.debug_print("Retrying the request in {0:.2f} seconds, attempt {1} of {2}".format(delay, attempt + 1, self._max_retries))
+        time.sleep(delay)
+
+    def _make_rest_calls(self, action_result, calls):
+        """ Send a batch of independent (endpoint, kwargs) calls concurrently. Each call reports to its own result,
+        which is merged into the action result in the order of the calls, the first failed call sets the status.
+        Returns the RetVal3 of each call, in the order of the calls.
+        """
+        if not calls:
+            return []
+
+        call_results = [RestCallResult() for _ in calls]
+        max_workers = min(len(calls), self._limiter.max_limit or DEFAULT_MAX_CONCURRENT_REQUESTS)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            responses = list(executor.map(lambda call, call_result: self._make_rest_call(call[0], call_result, **call[1]), calls, call_results))
+
+        failed = False
+        for (ret_val, response, resp_json), call_result in zip(responses, call_results):
+            for debug_data in call_result.debug_data:
+                action_result.add_debug_data(debug_data)
+            if phantom.is_fail(ret_val) and not failed:
+                failed = True
+                action_result.set_status(call_result.get_status(), call_result.get_message())
+
+        return responses
+
+    def _iter_pages(self, endpoint, action_result, params=None, page_size=0, ignore_auth=False, base_uri=None):
+        """ Iterate over a paginated REST listing, yielding a (ret_val, records) tuple per page.
+        A page_size of 0 fetches all the records with a single request. Otherwise the next page
+        is requested in the background while the caller is processing the current one.
+        """
+        params = dict(params or {})
+        params['page_size'] = page_size
+
+        def _fetch_page(page):
+            return self._make_rest_call(endpoint, action_result, params=dict(params, page=page), ignore_auth=ignore_auth, base_uri=base_uri)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            page = 0
+            future = executor.submit(_fetch_page, page)
+
+            while future is not None:
+                ret_val, response, resp_data = future.result()
+
+                if phantom.is_fail(ret_val):
+                    yield ret_val, None
+                    return
+
+                page += 1
+                num_pages = resp_data.get('num_pages', 1) if page_size else 1
+                future = executor.submit(_fetch_page, page) if page < num_pages else None
+
+                yield phantom.APP_SUCCESS, resp_data.get('data', [])
 
     def _test_connectivity(self, param):
 
@@ -536,16 +1228,7 @@ class PhantomConnector(BaseConnector):
         container_ids = param.get("container_ids", "current")
         values = param.get('values', '')
         if limit_search:
-            container_ids = list(
-                set([
-                    a for a in [
-                        int(z) if isinstance(z, int) or z.isdigit() else None for z in [
-                            self.get_container_id() if y == "current" else y for y in
-                            [x.strip() for x in container_ids.replace(",", " ").split()]
-                        ]
-                    ] if a
-                ])
-            )
+            container_ids = self._parse_container_ids(container_ids, self.get_container_id())
             action_result.update_param({"container_ids": str(sorted(container_ids)).strip("[]")})
 
         if limit_search and not container_ids:
@@ -556,73 +1239,77 @@ class PhantomConnector(BaseConnector):
 
         exact_match = param.get('exact_match', False)
 
+        ret_val, page_size = self._validate_integer(action_result, param.get('page_size', 0), 'page_size', True)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
         if exact_match and not cef_key:
             values = '"{}"'.format(values)
 
         url_enc_values = quote(values, safe='')
 
         if cef_key and exact_match:
-            endpoint = '/rest/artifact?_filter_cef__{}={}&page_size=0&pretty'.format(quote(cef_key, safe=''), repr(url_enc_values))
+            endpoint = '/rest/artifact?_filter_cef__{}={}&pretty'.format(quote(cef_key, safe=''), repr(url_enc_values))
         elif cef_key:
-            endpoint = '/rest/artifact?_filter_cef__{}__{}={}&page_size=0&pretty'.format(quote(cef_key, safe=''),
-                                                                                        "icontains", repr(url_enc_values))
+            endpoint = '/rest/artifact?_filter_cef__{}__{}={}&pretty'.format(quote(cef_key, safe=''), "icontains", repr(url_enc_values))
         else:
-            endpoint = '/rest/artifact?_filter_cef__{}={}&page_size=0&pretty'.format("icontains", repr(url_enc_values))
+            endpoint = '/rest/artifact?_filter_cef__{}={}&pretty'.format("icontains", repr(url_enc_values))
 
         if limit_search:
             endpoint += '&_filter_container__in={}'.format(container_ids)
 
-        ret_val, response, resp_data = self._make_rest_call(endpoint, action_result)
-
-        if phantom.is_fail(ret_val):
-            return action_result.set_status(phantom.APP_ERROR, 'Error retrieving records: {0}'.format(action_result.get_message()))
-
-        records = resp_data['data']
-
         values = values.lower()
+        artifacts_found = 0
 
-        for rec in records:
-            key, value = None, None
-
-            try:
-                cef_dict_items = rec['cef'].iteritems()
-            except Exception:
-                cef_dict_items = rec['cef'].items()
+        for ret_val, records in self._iter_pages(endpoint, action_result, params={'sort': 'id', 'order': 'asc'}, page_size=page_size):
 
-            for k, v in cef_dict_items:
+            if phantom.is_fail(ret_val):
+                return action_result.set_status(phantom.APP_ERROR, 'Error retrieving records: {0}'.format(action_result.get_message()))
 
-                curr_value = v
+            for rec in records:
+                key, value = None, None
 
                 try:
-                    # if we convert this if/elif statement to if/else, then it will try to
-                    # perform str() operation on even the already string/basestring data.
-                    # This works for every situation except for the unicode characters for which it will fail.
-                    # Hence, we are avoiding the str() on already string/basestring formatted data.
-                    if isinstance(curr_value, dict):
-                        curr_value = json.dumps(curr_value)
-                    if not isinstance(curr_value, str):  # For python 3
-                        curr_value = str(curr_value)
-                except Exception as e:
-                    self.debug_print('Error occurred while processing the artifacts data')
-                    return action_result.set_status(phantom.APP_ERROR,
-                            'Error occurred while processing the artifacts data: {}'.format(self._get_error_message_from_exception(e)))
+                    cef_dict_items = rec['cef'].iteritems()
+                except Exception:
+                    cef_dict_items = rec['cef'].items()
 
-                if values in curr_value.lower() or (exact_match and values.strip('"') == curr_value.lower()):
-                    key = k
-                    value = curr_value
-                    break
+                for k, v in cef_dict_items:
 
-            result = {
-                "id": rec['id'],
-                "container": rec['container'],
-                "container_name": rec['_pretty_container'],
-                "name": rec.get('name'),
-                "found in": key if key else "N/A",
-                "matched": value if value else "",
-            }
-            action_result.add_data(result)
+                    curr_value = v
 
-        action_result.update_summary({'artifacts_found': len(records), 'server': self._base_uri})
+                    try:
+                        # if we convert this if/elif statement to if/else, then it will try to
+                        # perform str() operation on even the already string/basestring data.
+                        # This works for every situation except for the unicode characters for which it will fail.
+                        # Hence, we are avoiding the str() on already string/basestring formatted data.
+                        if isinstance(curr_value, dict):
+                            curr_value = json.dumps(curr_value)
+                        if not isinstance(curr_value, str):  # For python 3
+                            curr_value = str(curr_value)
+                    except Exception as e:
+                        self.debug_print('Error occurred while processing the artifacts data')
+                        return action_result.set_status(phantom.APP_ERROR,
+                                'Error occurred while processing the artifacts data: {}'.format(self._get_error_message_from_exception(e)))
+
+                    if values in curr_value.lower() or (exact_match and values.strip('"') == curr_value.lower()):
+                        key = k
+                        value = curr_value
+                        break
+
+                result = {
+                    "id": rec['id'],
+                    "container": rec['container'],
+                    "container_name": rec['_pretty_container'],
+                    "name": rec.get('name'),
+                    "found in": key if key else "N/A",
+                    "matched": value if value else "",
+                }
+                action_result.add_data(result)
+
+            artifacts_found += len(records)
+
+        action_result.update_summary({'artifacts_found': artifacts_found, 'server': self._base_uri})
 
         return action_result.set_status(phantom.APP_SUCCESS)
 
@@ -687,20 +1374,7 @@ class PhantomConnector(BaseConnector):
         artifact['source_data_identifier'] = sdi
         artifact['run_automation'] = run_automation
 
-        for cef_name in loaded_cef:
-
-            if loaded_contains.get(cef_name):
-                continue
-
-            if cef_name not in CEF_NAME_MAPPING:
-                determined_contains = determine_contains(loaded_cef[cef_name]) if loaded_cef[cef_name] else None
-                if determined_contains:
-                    artifact['cef_types'][cef_name] = determined_contains
-            else:
-                try:
-                    artifact['cef_types'][cef_name] = CEF_JSON[cef_name]['contains']
-                except Exception:
-                    pass
+        self._infer_cef_types(artifact)
 
         success, response, resp_data = self._make_rest_call('/rest/artifact', action_result, method='post', data=artifact)
 
@@ -720,8 +1394,175 @@ class PhantomConnector(BaseConnector):
         self.debug_print("Successfully executed the action")
         return action_result.set_status(phantom.APP_SUCCESS)
 
+    @staticmethod
+    def _infer_cef_types(artifact):
+        """ Fill in the cef_types of the CEF fields of the artifact that do not have any yet """
+        cef_types = artifact.setdefault('cef_types', {})
+
+        for cef_name, cef_value in artifact.get('cef', {}).items():
+
+            if cef_types.get(cef_name):
+                continue
+
+            if cef_name not in CEF_NAME_MAPPING:
+                determined_contains = determine_contains(cef_value) if cef_value else None
+                if determined_contains:
+                    cef_types[cef_name] = determined_contains
+            else:
+                try:
+                    cef_types[cef_name] = CEF_JSON[cef_name]['contains']
+                except Exception:
+                    pass
+
+    def _add_artifacts(self, param):
+
+        self.save_progress("In action handler for: {0}".format(self.get_action_identifier()))
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        artifacts_json = param.get('artifacts_json')
+        vault_id = param.get('vault_id')
+        run_automation = param.get('run_automation', False)
+
+        container_id = param.get('container_id', self.get_container_id())
+        ret_val, container_id = self._validate_integer(action_result, container_id, 'container_id')
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        ret_val, chunk_size = self._validate_integer(action_result, param.get('chunk_size', DEFAULT_CHUNK_SIZE), 'chunk_size')
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        if bool(artifacts_json) == bool(vault_id):
+            return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_ARTIFACTS_SOURCE)
+
+        if artifacts_json:
+            try:
+                artifacts = json.loads(artifacts_json)
+            except Exception as e:
+                return action_result.set_status(phantom.APP_ERROR,
+                                "Error parsing artifacts list JSON: {}".format(self._get_error_message_from_exception(e)))
+            if not isinstance(artifacts, list):
+                return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_ARTIFACTS_LIST)
+        else:
+            ret_val, vault_info = self._get_vault_item(action_result, vault_id)
+            if phantom.is_fail(ret_val):
+                return action_result.get_status()
+            artifacts = self._read_ndjson(vault_info['path'])
+
+        def _prepare(artifact):
+            if not isinstance(artifact, dict):
+                raise ValueError(PHANTOM_ERR_ARTIFACTS_LIST)
+            artifact.setdefault('container_id', container_id)
+            artifact.setdefault('label', 'event')
+            artifact['run_automation'] = False
+            self._infer_cef_types(artifact)
+            return artifact
+
+        chunks = self._iter_chunks(map(_prepare, artifacts), chunk_size)
+        added = failed = 0
+
+        try:
+            for chunk_number, (ret_val, chunk, chunk_failed) in enumerate(self._post_artifact_chunks(action_result, chunks, run_automation)):
+                if phantom.is_fail(ret_val):
+                    action_result.update_summary({'artifacts_added': added, 'failed_artifact_count': failed})
+                    return action_result.set_status(phantom.APP_ERROR, "Error adding artifacts chunk {0}: {1}".format(
+                                                    chunk_number, action_result.get_message()))
+
+                action_result.add_data({'chunk': chunk_number, 'artifact_count': len(chunk), 'failed_artifact_count': chunk_failed})
+                added += len(chunk) - chunk_failed
+                failed += chunk_failed
+        except ArtifactReadError as e:
+            action_result.update_summary({'artifacts_added': added, 'failed_artifact_count': failed})
+            return action_result.set_status(phantom.APP_ERROR, "Error reading the artifacts: {}".format(e))
+        except Exception as e:
+            action_result.update_summary({'artifacts_added': added, 'failed_artifact_count': failed})
+            return action_result.set_status(phantom.APP_ERROR,
+                                "Error adding the artifacts: {}".format(self._get_error_message_from_exception(e)))
+
+        action_result.update_summary({'artifacts_added': added, 'failed_artifact_count': failed,
+                                      'container_id': container_id, 'server': self._base_uri})
+
+        if failed:
+            return action_result.set_status(phantom.APP_ERROR, "Failed to add one or more artifacts")
+
+        return action_result.set_status(phantom.APP_SUCCESS)
+
+    @staticmethod
+    def _iter_chunks(iterable, chunk_size):
+
+        iterator = iter(iterable)
+        chunk = list(itertools.islice(iterator, chunk_size))
+        while chunk:
+            yield chunk
+            chunk = list(itertools.islice(iterator, chunk_size))
+
+    @classmethod
+    def _read_ndjson(cls, file_path):
+        """ Lazily load a file with one JSON object per line, blank lines are skipped """
+        with open(file_path, 'r') as f:
+            yield from cls._parse_ndjson(f)
+
+    @staticmethod
+    def _parse_ndjson(lines):
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ValueError("Invalid JSON on line {0}: {1}".format(line_number, e))
+
+    @staticmethod
+    def _get_vault_tmp_dir():
+        if hasattr(Vault, 'get_vault_tmp_dir'):
+            return Vault.get_vault_tmp_dir()
+        return '/opt/phantom/vault/tmp'
+
+    @staticmethod
+    def _write_vault_tmp_file(data_stream, save_path, budget=None):
+        """ Copy the data stream to the file in chunks, a partially written file is removed if the copy fails.
+        Returns the SHA-1 and SHA-256 hashes of the data, computed while it is being copied,
+        and the header (first chunk) of the data, used to detect the file type without reading the file again.
+        """
+        sha1 = hashlib.sha1()
+        sha256 = hashlib.sha256()
+        header = None
+        try:
+            with open(save_path, 'wb') as uncompressed_file:
+                for chunk in iter(lambda: data_stream.read(DEFLATE_CHUNK_SIZE), b''):
+                    if budget:
+                        budget.add_bytes(len(chunk))
+                    if header is None:
+                        header = chunk
+                    sha1.update(chunk)
+                    sha256.update(chunk)
+                    uncompressed_file.write(chunk)
+        except Exception:
+            if os.path.exists(save_path):
+                os.remove(save_path)
+            raise
+
+        return {'sha1': sha1.hexdigest(), 'sha256': sha256.hexdigest(), 'header': header or b''}
+
     def _add_file_to_vault(self, action_result, data_stream, file_name, recursive, container_id):
 
+        ret_val, details, save_path = self._save_vault_tmp_file(data_stream, file_name)
+
+        if phantom.is_fail(ret_val):
+            return action_result.set_status(phantom.APP_ERROR, details)
+
+        ret_val, message, vault_info = self._register_vault_file(save_path, file_name, container_id, file_info=details)
+
+        if phantom.is_fail(ret_val):
+            return action_result.set_status(phantom.APP_ERROR, message)
+
+        return self._add_vault_info(action_result, vault_info, recursive, container_id, header=details['header'])
+
+    def _save_vault_tmp_file(self, data_stream, file_name):
+        """ Write the data stream to a new file in the vault tmp dir. Returns a (ret_val, error message, file path) tuple,
+        on success the hashes and header of the file are returned in place of the error message.
+        This does not touch any action result, so it is safe to call from the extraction workers.
+        """
         save_as = file_name or '_invalid_file_name_'
 
         # PAPP-9543 append a random string to the filename to make concurrent action runs succeed
@@ -732,15 +1573,16 @@ class PhantomConnector(BaseConnector):
         if os.path.dirname(save_as):
             save_as = '-'.join(save_as.split(os.sep))
 
-        if hasattr(Vault, 'get_vault_tmp_dir'):
-            vault_tmp_dir = Vault.get_vault_tmp_dir()
-        else:
-            vault_tmp_dir = '/opt/phantom/vault/tmp'
+        vault_tmp_dir = self._get_vault_tmp_dir()
+
+        if self._deflate_budget:
+            self._deflate_budget.add_file()
 
         try:
             save_path = os.path.join(vault_tmp_dir, save_as)
-            with open(save_path, 'wb') as uncompressed_file:
-                uncompressed_file.write(data_stream)
+            file_info = self._write_vault_tmp_file(data_stream, save_path, self._deflate_budget)
+        except DeflateBudgetExceeded:
+            raise
         except IOError as e:
             error_message = self._get_error_message_from_exception(e)
             try:
@@ -749,32 +1591,61 @@ class PhantomConnector(BaseConnector):
                     save_path = os.path.join(vault_tmp_dir, new_file_name)
                     self.debug_print("Original filename: {}".format(file_name))
                     self.debug_print("Modified filename: {}".format(new_file_name))
-                    with open(save_path, 'wb') as uncompressed_file:
-                        uncompressed_file.write(data_stream)
+                    file_info = self._write_vault_tmp_file(data_stream, save_path, self._deflate_budget)
                 else:
-                    return (action_result.set_status(phantom.APP_ERROR, "Error occurred while adding file to Vault. Error Details:{}".format(
-                        self._get_error_message_from_exception(e))))
+                    return RetVal3(phantom.APP_ERROR, "Error occurred while adding file to Vault. Error Details:{}".format(
+                        self._get_error_message_from_exception(e)))
+            except DeflateBudgetExceeded:
+                raise
             except Exception as e:
-                return (action_result.set_status(phantom.APP_ERROR, "Error occurred while adding file to Vault. Error Details:{}".format(
-                    self._get_error_message_from_exception(e))))
+                return RetVal3(phantom.APP_ERROR, "Error occurred while adding file to Vault. Error Details:{}".format(
+                    self._get_error_message_from_exception(e)))
         except Exception as e:
-            return action_result.set_status(phantom.APP_ERROR,
+            return RetVal3(phantom.APP_ERROR,
                             "Error occurred while adding file to Vault. Error Details:{}".format(self._get_error_message_from_exception(e)))
 
+        return RetVal3(phantom.APP_SUCCESS, file_info, save_path)
+
+    def _register_vault_file(self, save_path, file_name, container_id, file_info=None):
+        """ Add a file of the vault tmp dir to the vault, returns a (ret_val, error message, vault info) tuple.
+        When deduplication is enabled and the container already has a file with the same content,
+        the file is discarded and the vault info of the existing file is returned instead.
+        This does not touch any action result, so it is safe to call from the extraction workers.
+        """
+        if not (self._deduplicate and file_info):
+            return self._add_vault_file(save_path, file_name, container_id)
+
+        file_hashes = (file_info['sha1'], file_info['sha256'])
+        vault_info, claim = self._claim_vault_hashes(container_id, file_hashes)
+        if vault_info:
+            self.debug_print("Skipping {0}, its content is already in the vault as {1}".format(file_name, vault_info.get('vault_id')))
+            os.remove(save_path)
+            return RetVal3(phantom.APP_SUCCESS, None, vault_info)
+
+        ret_val, message, vault_info = phantom.APP_ERROR, None, None
+        try:
+            ret_val, message, vault_info = self._add_vault_file(save_path, file_name, container_id)
+        finally:
+            self._release_vault_hashes(container_id, file_hashes, claim, vault_info if phantom.is_success(ret_val) else None)
+
+        return RetVal3(ret_val, message, vault_info)
+
+    def _add_vault_file(self, save_path, file_name, container_id):
+
         try:
             success, message, vault_id = ph_rules.vault_add(container=container_id, file_location=save_path, file_name=file_name)
         except Exception as e:
-            return action_result.set_status(phantom.APP_ERROR,
-                                        "Failed to add file into vault: {}".format(self._get_error_message_from_exception(e)))
+            return RetVal3(phantom.APP_ERROR, "Failed to add file into vault: {}".format(self._get_error_message_from_exception(e)))
 
         if not success:
-            return action_result.set_status(phantom.APP_ERROR, "Failed to add file into vault: {0}".format(message))
+            return RetVal3(phantom.APP_ERROR, "Failed to add file into vault: {0}".format(message))
 
+        vault_info = None
         try:
             success, message, resp_data = ph_rules.vault_info(vault_id=vault_id.lower())
 
             if not success:
-                return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_GET_VAULT_INFO.format(message))
+                return RetVal3(phantom.APP_ERROR, PHANTOM_ERR_GET_VAULT_INFO.format(message))
 
             for resp_element in resp_data:
                 resp_filename = resp_element['name']
@@ -784,9 +1655,73 @@ class PhantomConnector(BaseConnector):
                     break
 
         except Exception as e:
-            return action_result.set_status(phantom.APP_ERROR,
+            return RetVal3(phantom.APP_ERROR,
                             "Failed to retrieve info about file added to vault {}".format(self._get_error_message_from_exception(e)))
 
+        return RetVal3(phantom.APP_SUCCESS, None, vault_info)
+
+    def _claim_vault_hashes(self, container_id, file_hashes):
+        """ Returns a (vault info, claim) tuple for a file of the container with the given hashes.
+        If the container has no such file yet, the hashes are claimed with a future that the caller has to
+        resolve with _release_vault_hashes once the file is added, other workers with the same content wait on it.
+        """
+        while True:
+            with self._vault_hashes_lock:
+                known_hashes = self._get_vault_hashes(container_id)
+                known = next((known_hashes[file_hash] for file_hash in file_hashes if file_hash in known_hashes), None)
+
+                if known is None:
+                    claim = Future()
+                    known_hashes.update(dict.fromkeys(file_hashes, claim))
+                    return None, claim
+
+            if not isinstance(known, Future):
+                return known, None
+
+            vault_info = known.result()
+            if vault_info:
+                return vault_info, None
+            # Adding the file failed in the worker that claimed it, claim it again
+
+    def _release_vault_hashes(self, container_id, file_hashes, claim, vault_info):
+
+        with self._vault_hashes_lock:
+            known_hashes = self._vault_hashes[container_id]
+            for file_hash in file_hashes:
+                if known_hashes.get(file_hash) is claim:
+                    if vault_info:
+                        known_hashes[file_hash] = vault_info
+                    else:
+                        del known_hashes[file_hash]
+
+        claim.set_result(vault_info)
+
+    def _get_vault_hashes(self, container_id):
+        """ Returns the known hashes of the files of the container, must be called with the vault hashes lock held """
+        known_hashes = self._vault_hashes.get(container_id)
+
+        if known_hashes is None:
+            # Index the files already in the container once per action run
+            known_hashes = self._vault_hashes[container_id] = {}
+            try:
+                success, message, vault_items = ph_rules.vault_info(container_id=container_id)
+                if not success:
+                    self.debug_print(PHANTOM_ERR_GET_VAULT_INFO.format(message))
+                    vault_items = []
+            except Exception as e:
+                self.debug_print(PHANTOM_ERR_GET_VAULT_INFO.format(self._get_error_message_from_exception(e)))
+                vault_items = []
+
+            for vault_item in vault_items:
+                # The vault id of a file is its SHA-1 hash
+                for file_hash in (vault_item.get('vault_id'), (vault_item.get('metadata') or {}).get('sha256')):
+                    if file_hash:
+                        known_hashes[file_hash.lower()] = vault_item
+
+        return known_hashes
+
+    def _add_vault_info(self, action_result, vault_info, recursive, container_id, header=None):
+
         action_result.add_data(vault_info)
 
         if recursive:
@@ -795,16 +1730,106 @@ class PhantomConnector(BaseConnector):
 
             file_name = vault_info['name']
 
-            file_type, is_supported = self.check_deflation_supported_file(file_path)
+            file_type, is_supported = self.check_deflation_supported_file(file_path, header)
 
             if not is_supported:
                 return (phantom.APP_SUCCESS)
 
-            self._extract_file(action_result, file_path, file_name, recursive, container_id)
-            self._level -= 1
+            # Nested archives are queued, _deflate_item extracts them once it is done with the current level
+            self._deflate_queue.append((file_path, file_name, self._level + 1, header))
 
         return (phantom.APP_SUCCESS)
 
+    def _add_members_to_vault(self, action_result, members, open_member, recursive, container_id, read_lock=None):
+        """ Add the members of an archive to the vault, members is a list of (member, file name) tuples
+        and open_member returns a file object for a member. With more than one deflate worker, the members are
+        extracted and added to the vault concurrently, the vault info is still added in the order of the members.
+        read_lock serializes the reads of archives that can not be read from several threads at once.
+        """
+        if self._deflate_workers <= 1:
+            for member, file_name in members:
+                with open_member(member) as member_file:
+                    ret_val = self._add_file_to_vault(action_result, member_file, file_name, recursive, container_id)
+
+                if phantom.is_fail(ret_val):
+                    return ret_val
+
+            return phantom.APP_SUCCESS
+
+        # Set once a member failed or a budget was exceeded, the workers that are still running
+        # stop before adding their member to the vault, and the members not started yet are skipped
+        abort = threading.Event()
+
+        def _store_member(member, file_name):
+            if abort.is_set():
+                return None
+
+            try:
+                with read_lock or contextlib.nullcontext():
+                    with open_member(member) as member_file:
+                        ret_val, details, save_path = self._save_vault_tmp_file(member_file, file_name)
+            except DeflateBudgetExceeded:
+                abort.set()
+                raise
+
+            if phantom.is_fail(ret_val):
+                abort.set()
+                return ret_val, details, None, None
+
+            if abort.is_set():
+                os.remove(save_path)
+                return None
+
+            ret_val, message, vault_info = self._register_vault_file(save_path, file_name, container_id, file_info=details)
+            if phantom.is_fail(ret_val):
+                abort.set()
+            return ret_val, message, vault_info, details['header']
+
+        executor = ThreadPoolExecutor(max_workers=self._deflate_workers)
+        futures = []
+        consumed = 0
+        try:
+            futures = [executor.submit(_store_member, member, file_name) for member, file_name in members]
+
+            for future in futures:
+                result = future.result()
+                consumed += 1
+
+                # Skipped because a later member stopped the deflation, its error is raised or returned when it is reached
+                if result is None:
+                    continue
+
+                ret_val, message, vault_info, header = result
+
+                if phantom.is_fail(ret_val):
+                    return action_result.set_status(phantom.APP_ERROR, message)
+
+                ret_val = self._add_vault_info(action_result, vault_info, recursive, container_id, header=header)
+
+                if phantom.is_fail(ret_val):
+                    return ret_val
+        finally:
+            abort.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+            self._add_late_vault_info(action_result, futures[consumed:])
+
+        return phantom.APP_SUCCESS
+
+    @staticmethod
+    def _add_late_vault_info(action_result, futures):
+        """ Report the files that the extraction workers added to the vault before they noticed the deflation was stopped """
+        for future in futures:
+            if future.cancelled() or future.exception() is not None:
+                continue
+
+            result = future.result()
+            if result is None:
+                continue
+
+            ret_val, message, vault_info, header = result
+            if phantom.is_success(ret_val) and vault_info:
+                action_result.add_data(vault_info)
+
     @staticmethod
     def _has_allowed_archive_extension(file_name, allowed_extensions):
         if allowed_extensions:
@@ -815,13 +1840,12 @@ class PhantomConnector(BaseConnector):
 
         return True
 
-    def _extract_file(self, action_result, file_path, file_name, recursive, container_id=None, password=None):
+    def _extract_file(self, action_result, file_path, file_name, recursive, container_id=None, password=None, header=None):
 
-        self._level += 1
         if container_id is None:
             container_id = self.get_container_id()
 
-        file_type, is_supported = self.check_deflation_supported_file(file_path)
+        file_type, is_supported = self.check_deflation_supported_file(file_path, header)
 
         if not is_supported:
             return action_result.set_status(phantom.APP_ERROR, "Deflation of file type: {0} not supported".format(file_type))
@@ -832,35 +1856,30 @@ class PhantomConnector(BaseConnector):
             self.debug_print(f'Skipping extraction of {file_name} since it is not in the allowed extensions list: {allowed_extensions}')
             return phantom.APP_SUCCESS
 
-        data = None
+        # A compressed tarball is extracted with a single pass over it, without vaulting the intermediate tar file
+        tar_compression = COMPRESSED_TAR_TYPES.get(file_type)
+        if tar_compression and not self._vault_intermediate_tar and self._is_compressed_tarball(file_path, tar_compression):
+            return self._extract_tar_stream(action_result, file_path, tar_compression, recursive, container_id)
+
+        # The members are streamed to the vault in chunks, so they are never loaded in memory as a whole
         if file_type == 'application/x-bzip2':
             # gz and bz2 don't provide a nice way to test, so trial and error
             try:
                 with bz2.BZ2File(file_path, 'r') as f:
-                    data = f.read()
+                    ret_val = self._add_file_to_vault(action_result, f, os.path.splitext(file_name)[0], recursive, container_id)
             except IOError:
                 return action_result.set_status(phantom.APP_ERROR, "Unable to deflate bz2 file")
 
-            if data is None:
-                return phantom.APP_SUCCESS
-
-            ret_val = self._add_file_to_vault(action_result, data, os.path.splitext(file_name)[0], recursive, container_id)
-
             if phantom.is_fail(ret_val):
                 return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_DECOMPRESSING_FILE.format(file_type, action_result.get_message()))
 
         elif file_type == 'application/x-gzip' or file_type == 'application/gzip':
             try:
                 with gzip.GzipFile(file_path, 'r') as f:
-                    data = f.read()
+                    ret_val = self._add_file_to_vault(action_result, f, os.path.splitext(file_name)[0], recursive, container_id)
             except IOError:
                 return action_result.set_status(phantom.APP_ERROR, "Unable to deflate gzip file")
 
-            if data is None:
-                return phantom.APP_SUCCESS
-
-            ret_val = self._add_file_to_vault(action_result, data, os.path.splitext(file_name)[0], recursive, container_id)
-
             if phantom.is_fail(ret_val):
                 return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_DECOMPRESSING_FILE.format(file_type, action_result.get_message()))
 
@@ -869,28 +1888,22 @@ class PhantomConnector(BaseConnector):
                 return action_result.set_status(phantom.APP_ERROR, "Unable to deflate zip file")
 
             try:
-                compressed_file = ''
                 with zipfile.ZipFile(file_path, 'r') as vault_file:
                     if password:
                         vault_file.setpassword(password.encode())
 
-                    archived_files = vault_file.namelist()
-
-                    for compressed_file in archived_files:
-
-                        save_as = os.path.basename(compressed_file)
-
-                        if not os.path.basename(save_as):
-                            continue
+                    members = [(compressed_file, os.path.basename(compressed_file)) for compressed_file in vault_file.namelist()
+                               if os.path.basename(compressed_file)]
 
-                        ret_val = self._add_file_to_vault(action_result, vault_file.read(compressed_file), save_as,
-                                                          recursive, container_id)
+                    # zip members can be read concurrently, each one is decompressed by the thread reading it
+                    ret_val = self._add_members_to_vault(action_result, members, vault_file.open, recursive, container_id)
 
-                        if phantom.is_fail(ret_val):
-                            return ret_val
+                    if phantom.is_fail(ret_val):
+                        return ret_val
+            except DeflateBudgetExceeded:
+                raise
             except Exception as e:
                 error_message = self._get_error_message_from_exception(e)
-                error_message = error_message.replace(compressed_file, file_name)
                 return action_result.set_status(phantom.APP_ERROR, "Unable to open the zip file: {}. {}".format(file_path, error_message))
 
             return (phantom.APP_SUCCESS)
@@ -899,24 +1912,57 @@ class PhantomConnector(BaseConnector):
         elif tarfile.is_tarfile(file_path):
             with tarfile.open(file_path, 'r') as vault_file:
 
-                for member in vault_file.getmembers():
+                # Only interested in files, pass on dirs, links, etc.
+                members = [(member, os.path.basename(member.name)) for member in vault_file.getmembers() if member.isfile()]
+
+                # The tar file is a single stream, so only the vault additions run concurrently
+                ret_val = self._add_members_to_vault(action_result, members, vault_file.extractfile, recursive, container_id,
+                                                     read_lock=threading.Lock())
+
+                if phantom.is_fail(ret_val):
+                    return action_result.set_status(phantom.APP_ERROR, "Error decompressing tar file.")
+
+            return (phantom.APP_SUCCESS)
+
+        return action_result.set_status(phantom.APP_SUCCESS)
+
+    @staticmethod
+    def _is_compressed_tarball(file_path, compression):
+        """ Only the first block of the file is decompressed to check for a tar header """
+        try:
+            # Opening succeeds on any payload starting with a zero block, it reads as an empty archive
+            with tarfile.open(file_path, 'r|{}'.format(compression)) as tar:
+                return tar.next() is not None
+        except Exception:
+            return False
+
+    def _extract_tar_stream(self, action_result, file_path, compression, recursive, container_id):
+
+        try:
+            # Stream mode reads the tarball sequentially, each member has to be processed before moving to the next one
+            with tarfile.open(file_path, 'r|{}'.format(compression)) as vault_file:
+
+                for member in vault_file:
 
                     # Only interested in files, pass on dirs, links, etc.
                     if not member.isfile():
                         continue
 
-                    ret_val = self._add_file_to_vault(action_result, vault_file.extractfile(member).read(),
-                                                    os.path.basename(member.name), recursive, container_id)
+                    with vault_file.extractfile(member) as member_file:
+                        ret_val = self._add_file_to_vault(action_result, member_file, os.path.basename(member.name), recursive, container_id)
 
                     if phantom.is_fail(ret_val):
                         return action_result.set_status(phantom.APP_ERROR, "Error decompressing tar file.")
+        except DeflateBudgetExceeded:
+            raise
+        except Exception as e:
+            return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_DECOMPRESSING_FILE.format(
+                                            'tar.{}'.format(compression), self._get_error_message_from_exception(e)))
 
-            return (phantom.APP_SUCCESS)
-
-        return action_result.set_status(phantom.APP_SUCCESS)
+        return phantom.APP_SUCCESS
 
     @staticmethod
-    def check_deflation_supported_file(file_path) -> Tuple[str, bool]:
+    def check_deflation_supported_file(file_path, header=None) -> Tuple[str, bool]:
         """
         Checks if the file is supported for deflation.
 
@@ -924,17 +1970,41 @@ class PhantomConnector(BaseConnector):
         Systems recognizing MS Office files (eg. xlsx) as zip
         files which lead to an enormous deflation process run
         hanging the service.
+
+        When the header (first bytes) of the file is provided,
+        the type is detected from it instead of reading the file.
         """
-        msooxml_magic_file_path = os.path.join(pathlib.Path(__file__).parent.resolve(), "magic_files", "msooxml")
-        m = magic.Magic(mime=True, magic_file=msooxml_magic_file_path)
-        file_type = m.from_file(file_path)
+        msooxml_magic, default_magic = _get_magic_detectors()
+
+        def _detect(detector):
+            return detector.from_file(file_path) if header is None else detector.from_buffer(header)
+
+        file_type = _detect(msooxml_magic)
 
         if file_type not in OPEN_XML_FORMATS:
             # fallback to the default magic files definitions
-            file_type = magic.from_file(file_path, mime=True)
+            file_type = _detect(default_magic)
 
         return file_type, file_type in SUPPORTED_FILES
 
+    def _get_vault_item(self, action_result, vault_id):
+
+        try:
+            success, message, vault_info = ph_rules.vault_info(vault_id=vault_id)
+
+            if not success:
+                return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_GET_VAULT_INFO.format(message)), None
+
+            vault_info = list(vault_info)[0]
+        except IndexError:
+            return action_result.set_status(phantom.APP_ERROR,
+                                "Error occurred while accessing the vault ID. Please verify the provided vault ID in the action parameter"), None
+        except Exception as e:
+            return action_result.set_status(phantom.APP_ERROR,
+                                "Failed to get vault item info: {}".format(self._get_error_message_from_exception(e))), None
+
+        return phantom.APP_SUCCESS, vault_info
+
     def _deflate_item(self, param):
 
         action_result = self.add_action_result(ActionResult(dict(param)))
@@ -943,26 +2013,18 @@ class PhantomConnector(BaseConnector):
 
         container_id = param.get('container_id')
         password = param.get('password')
+        self._deduplicate = param.get('deduplicate', False)
+        self._vault_intermediate_tar = param.get('vault_intermediate_tar', False)
         ret_val, container_id = self._validate_integer(action_result, container_id, 'container_id')
         if phantom.is_fail(ret_val):
             return action_result.get_status()
 
-        try:
-            success, message, vault_info = ph_rules.vault_info(vault_id=vault_id)
-
-            if not success:
-                return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_GET_VAULT_INFO.format(message))
+        ret_val, vault_info = self._get_vault_item(action_result, vault_id)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
 
-            vault_info = list(vault_info)[0]
-
-            file_path = vault_info['path']
-            file_name = vault_info['name']
-        except IndexError:
-            return action_result.set_status(phantom.APP_ERROR,
-                                "Error occurred while accessing the vault ID. Please verify the provided vault ID in the action parameter")
-        except Exception as e:
-            return action_result.set_status(phantom.APP_ERROR,
-                                "Failed to get vault item info: {}".format(self._get_error_message_from_exception(e)))
+        file_path = vault_info['path']
+        file_name = vault_info['name']
 
         try:
             file_type, is_supported = self.check_deflation_supported_file(file_path)
@@ -974,11 +2036,35 @@ class PhantomConnector(BaseConnector):
         if not is_supported:
             return action_result.set_status(phantom.APP_ERROR, "Deflation of file type: {0} not supported".format(file_type))
 
-        ret_val = self._extract_file(action_result, file_path, file_name, param.get('recursive', False),
-                                     container_id, password=password)
+        try:
+            input_size = os.path.getsize(file_path)
+        except Exception:
+            return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_FILE_PATH_NOT_FOUND)
 
-        if phantom.is_fail(ret_val):
-            return action_result.get_status()
+        self._deflate_budget = DeflateBudget(input_size, **self._deflate_limits)
+
+        # Nested archives are extracted breadth first from a work queue instead of recursively,
+        # so the shallower files are in the vault before the limits of the budget stop the deflation
+        self._deflate_queue = deque([(file_path, file_name, 1, None)])
+
+        try:
+            while self._deflate_queue:
+                file_path, file_name, depth, header = self._deflate_queue.popleft()
+                self._deflate_budget.check_depth(depth)
+                self._level = depth
+
+                # Only the archive from the vault ID is protected by the password
+                ret_val = self._extract_file(action_result, file_path, file_name, param.get('recursive', False),
+                                             container_id, password=password if depth == 1 else None, header=header)
+
+                if depth == 1 and phantom.is_fail(ret_val):
+                    return action_result.get_status()
+
+        except DeflateBudgetExceeded as e:
+            summary = action_result.update_summary({})
+            summary['total_vault_items'] = action_result.get_data_size()
+            summary['budget_exceeded'] = str(e)
+            return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_DEFLATE_BUDGET.format(e, action_result.get_data_size()))
 
         summary = action_result.update_summary({})
         summary['total_vault_items'] = action_result.get_data_size()
@@ -999,37 +2085,155 @@ class PhantomConnector(BaseConnector):
         if phantom.is_fail(ret_val):
             return action_result.get_status()
 
-        # Encode list_name to consider special url encoded characters like '\' in URL
-        list_name = quote(list_name, safe='')
+        # A JSON formatted list looks up all of its values with a single pass over the custom list
+        multiple_values = False
+        try:
+            loaded_values = json.loads(values)
+            if isinstance(loaded_values, list):
+                if not loaded_values:
+                    return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_EMPTY_VALUES_LIST)
+                multiple_values = True
+                values = [value if isinstance(value, str) else json.dumps(value) for value in loaded_values]
+        except Exception:
+            pass
 
-        endpoint = '/rest/decided_list/{}'.format(list_name)
+        if not multiple_values:
+            values = [values]
 
-        ret_val, response, resp_data = self._make_rest_call(endpoint, action_result)
+        # Remove duplicate values but keep the order in which they were given
+        values = list(dict.fromkeys(values))
+
+        ret_val, decided_list, index = self._get_decided_list(action_result, list_name, exact_match)
 
         if phantom.is_fail(ret_val):
             return action_result.get_status()
 
-        j = resp_data
-        list_id = j['id']
-        content = j.get('content')  # pylint: disable=E1101
+        list_id = decided_list['id']
+
+        # An exact lookup in the cached index only reads the matching rows of the list
+        if index is not None:
+            try:
+                found = index.lookup(values, column_index)
+                content = index.get_rows(rownum for rownum, cid, value_idx in found)
+            except Exception as e:
+                return action_result.set_status(phantom.APP_ERROR, "Error reading the custom list cache: {}".format(
+                                                self._get_error_message_from_exception(e)))
+            finally:
+                index.close()
+        else:
+            content = decided_list.get('content')  # pylint: disable=E1101
+            found = self._match_list_values(content, values, exact_match, column_index)
+
         coordinates = []
-        found = 0
-        for rownum, row in enumerate(content):
-            for cid, value in enumerate(row):
-                if column_index is None or cid == column_index:
-                    if exact_match and value == values:
-                        found += 1
-                        action_result.add_data(row)
-                        coordinates.append((rownum, cid))
-                    elif not exact_match and value and values in value:
-                        found += 1
-                        action_result.add_data(row)
-                        coordinates.append((rownum, cid))
-
-        action_result.update_summary({'server': self._base_uri, 'found_matches': found, 'locations': coordinates, 'list_id': list_id})
+        matches = [0] * len(values)
+
+        for rownum, cid, value_idx in found:
+            matches[value_idx] += 1
+            action_result.add_data(content[rownum])
+            coordinates.append((rownum, cid))
+
+        summary = {'server': self._base_uri, 'found_matches': len(coordinates), 'locations': coordinates, 'list_id': list_id}
+        if multiple_values:
+            summary['matches_per_value'] = [{'value': value, 'matches': count} for value, count in zip(values, matches)]
+        action_result.update_summary(summary)
         self.debug_print("Successfully executed the action")
         return action_result.set_status(phantom.APP_SUCCESS)
 
+    @staticmethod
+    def _match_list_values(content, values, exact_match, column_index):
+        """ Find the values in the content of a custom list.
+        Returns the (row, column, value index) of every match, in the order of the list content.
+        """
+        found = []
+
+        if exact_match:
+            value_indexes = {value: value_idx for value_idx, value in enumerate(values)}
+        else:
+            automaton = AhoCorasick(values)
+
+        for rownum, row in enumerate(content):
+            for cid, cell in enumerate(row):
+                if column_index is not None and cid != column_index:
+                    continue
+                if not isinstance(cell, str):
+                    continue
+                if exact_match:
+                    if cell in value_indexes:
+                        found.append((rownum, cid, value_indexes[cell]))
+                elif cell:
+                    found.extend((rownum, cid, value_idx) for value_idx in sorted(automaton.search(cell)))
+
+        return found
+
+    def _get_decided_list(self, action_result, list_name, exact_match=False):
+        """ Retrieve a custom list. Returns a (ret_val, decided_list, index) tuple.
+        When the decided_list_cache asset configuration parameter is enabled, the list is indexed in an on-disk cache
+        and served from it for as long as its modified time on the server is unchanged. On a cache hit for an exact lookup,
+        the decided list only has its id and the DecidedListIndex to look the values up in is returned, the caller closes it.
+        Otherwise the index is None and the decided list has its content.
+        """
+        # Encode list_name to consider special url encoded characters like '\' in URL
+        endpoint = '/rest/decided_list/{}'.format(quote(list_name, safe=''))
+
+        if not self._decided_list_cache:
+            ret_val, response, resp_data = self._make_rest_call(endpoint, action_result)
+            return RetVal3(ret_val, resp_data)
+
+        # The listing leaves the expensive fields of the list out, the content among them, as include_expensive is not given
+        params = {'_filter_name': '"{0}"'.format(list_name), 'page_size': 1}
+        ret_val, response, resp_data = self._make_rest_call('/rest/decided_list', action_result, params=params)
+
+        if phantom.is_fail(ret_val):
+            return RetVal3(ret_val)
+
+        modified_time = resp_data['data'][0].get('modified_time') if resp_data.get('data') else None
+        cache_path = self._get_decided_list_cache_path(list_name)
+
+        if modified_time:
+            index = self._open_decided_list_cache(cache_path)
+            if index is not None and index.modified_time == modified_time:
+                self.debug_print("Using the cached index of the custom list: {}".format(list_name))
+                if exact_match:
+                    return RetVal3(phantom.APP_SUCCESS, {'id': index.list_id}, index)
+                try:
+                    return RetVal3(phantom.APP_SUCCESS, {'id': index.list_id, 'content': index.get_content()}, None)
+                except Exception as e:
+                    self.debug_print("Unable to read the custom list cache. Error: {}".format(self._get_error_message_from_exception(e)))
+                finally:
+                    index.close()
+            elif index is not None:
+                index.close()
+
+        ret_val, response, decided_list = self._make_rest_call(endpoint, action_result)
+
+        if phantom.is_fail(ret_val):
+            return RetVal3(ret_val)
+
+        if modified_time:
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                DecidedListIndex.build(cache_path, decided_list, modified_time)
+            except Exception as e:
+                self.debug_print("Unable to save the custom list cache. Error: {}".format(self._get_error_message_from_exception(e)))
+
+        return RetVal3(phantom.APP_SUCCESS, decided_list, None)
+
+    def _get_decided_list_cache_path(self, list_name):
+
+        cache_key = hashlib.sha256('{0}/{1}'.format(self._base_uri, list_name).encode('utf-8')).hexdigest()
+        return os.path.join(self.get_state_dir(), DECIDED_LIST_CACHE_DIR, '{}.db'.format(cache_key))
+
+    def _open_decided_list_cache(self, cache_path):
+
+        if not os.path.exists(cache_path):
+            return None
+
+        try:
+            return DecidedListIndex(cache_path)
+        except Exception as e:
+            self.debug_print("Unable to load the custom list cache. Error: {}".format(self._get_error_message_from_exception(e)))
+            return None
+
     def _create_list(self, list_name, row, action_result):
 
         try:
@@ -1096,38 +2300,68 @@ class PhantomConnector(BaseConnector):
 
         return action_result.set_status(phantom.APP_SUCCESS)
 
-    def _add_artifact_list(self, action_result, artifacts, ignore_auth=False):
-        """ Add a list of artifacts """
+    def _post_artifact_chunk(self, action_result, artifacts, ignore_auth=False, base_uri=None):
+        """ Add a list of artifacts, returns the status of the request and the number of artifacts that failed to be added """
         ret_val, response, resp_data = self._make_rest_call('/rest/artifact', action_result,
-                                        method='post', data=artifacts, ignore_auth=ignore_auth)
+                                        method='post', data=artifacts, ignore_auth=ignore_auth, base_uri=base_uri)
         if phantom.is_fail(ret_val):
-            return action_result.set_status(phantom.APP_ERROR, "Error adding artifact: {}".format(action_result.get_message()))
+            return ret_val, None
         failed = 0
         for resp in resp_data:  # is a list
             if resp.get('failed') is True:
                 self.debug_print(resp.get('message'))
                 failed += 1
+        return phantom.APP_SUCCESS, failed
+
+    def _add_artifact_list(self, action_result, artifacts, ignore_auth=False, base_uri=None):
+        """ Add a list of artifacts """
+        ret_val, failed = self._post_artifact_chunk(action_result, artifacts, ignore_auth=ignore_auth, base_uri=base_uri)
+        if phantom.is_fail(ret_val):
+            return action_result.set_status(phantom.APP_ERROR, "Error adding artifact: {}".format(action_result.get_message()))
         if failed:
             action_result.update_summary({'failed_artifact_count': failed})
             return action_result.set_status(phantom.APP_ERROR, "Failed to add one or more artifacts")
         return phantom.APP_SUCCESS
 
-    def _create_container_copy(self, action_result, container_id, destination, source, source_local=False,
-                               destination_local=False, keep_owner=False, run_automation=True, label=None):
-        """ destination: where new container is being made """
-        """ source: where the original container is """
-        """ Create a copy of this existing container, including all of its artifacts """
+    def _post_artifact_chunks(self, action_result, chunks, run_automation, ignore_auth=False, base_uri=None):
+        """ Post chunks of artifacts one after the other, yields a (ret_val, chunk, failed count) tuple once each chunk is posted.
+        The next chunk is read before the current one is posted, so that only the very last artifact triggers the active playbooks.
+        Errors while reading the chunks are raised as ArtifactReadError.
+        """
+        chunks = iter(chunks)
+        chunk = self._next_artifact_chunk(chunks)
+        while chunk:
+            next_chunk = self._next_artifact_chunk(chunks)
+            if not next_chunk:
+                chunk[-1]['run_automation'] = run_automation
+
+            ret_val, failed = self._post_artifact_chunk(action_result, chunk, ignore_auth=ignore_auth, base_uri=base_uri)
+            yield ret_val, chunk, failed
+            chunk = next_chunk
+
+    def _next_artifact_chunk(self, chunks):
+        try:
+            return next(chunks, None)
+        except Exception as e:
+            raise ArtifactReadError(self._get_error_message_from_exception(e))
+
+    def _create_destination_container(self, action_result, container_id, destination, source, keep_owner=False, label=None):
+        """ Create a copy of the source container without its artifacts, returns the status and the new container id """
 
         # Retrieve original container
-        self._base_uri = source
         url = '/rest/container/{}'.format(container_id)
 
-        ret_val, response, resp_data = self._make_rest_call(url, action_result, ignore_auth=source_local)
+        ret_val, response, resp_data = source.rest_call(url, action_result)
 
         if phantom.is_fail(ret_val):
-            return ret_val
+            return ret_val, None
+
+        container = self._prepare_container_copy(resp_data, destination.local, keep_owner=keep_owner, label=label)
+
+        return self._post_container(action_result, destination, container)
+
+    def _prepare_container_copy(self, container, destination_local, keep_owner=False, label=None):
 
-        container = resp_data
         # Remove data from original we dont want
         container.pop('asset', None)
         container.pop('artifact_count', None)
@@ -1147,9 +2381,12 @@ class PhantomConnector(BaseConnector):
             container['asset_id'] = int(self.get_asset_id())
         # container['ingest_app_id'] = container.pop('ingest_app', None)
 
-        self._base_uri = destination
-        ret_val, response, resp_data = self._make_rest_call('/rest/container', action_result,
-                                method='post', data=container, ignore_auth=destination_local)
+        return container
+
+    def _post_container(self, action_result, destination, container):
+        """ Create the container on the destination, returns the status and the new container id """
+
+        ret_val, response, resp_data = destination.rest_call('/rest/container', action_result, method='post', data=container)
 
         if phantom.is_fail(ret_val):
 
@@ -1163,44 +2400,255 @@ class PhantomConnector(BaseConnector):
                 act_message += '. Try setting the keep_owner parameter to false.'
                 action_result.set_status(ret_val, act_message)
 
-            return ret_val
+            return ret_val, None
 
         try:
             new_container_id = resp_data['id']
         except KeyError:
             # The newly created container wont get cleaned up
-            return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_UNABLE_RETRIEVE_ID)
+            return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_UNABLE_RETRIEVE_ID), None
+
+        return phantom.APP_SUCCESS, new_container_id
+
+    def _list_vault_files(self, action_result, client, container_id):
+        """ List the vault files of a container, the vault id of a file is its SHA-1 hash """
+        if client.local:
+            try:
+                success, message, vault_items = ph_rules.vault_info(container_id=container_id)
+            except Exception as e:
+                return action_result.set_status(phantom.APP_ERROR,
+                                                PHANTOM_ERR_GET_VAULT_INFO.format(self._get_error_message_from_exception(e))), None
+            if not success:
+                # There is no vault info for a container without vault files
+                vault_items = []
+            return phantom.APP_SUCCESS, [{'vault_id': item['vault_id'].lower(), 'name': item['name'], 'path': item['path']}
+                                         for item in (vault_items or [])]
+
+        vault_files = []
+        for ret_val, attachments in client.iter_pages('/rest/container_attachment', action_result,
+                                                      params={'_filter_container': container_id}, page_size=DEFAULT_CHUNK_SIZE):
+            if phantom.is_fail(ret_val):
+                return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_GET_VAULT_INFO.format(action_result.get_message())), None
+            vault_files.extend({'vault_id': attachment['hash'].lower(), 'name': attachment['name']} for attachment in attachments)
+        return phantom.APP_SUCCESS, vault_files
+
+    @staticmethod
+    def _iter_attachment_body(container_id, vault_file):
+        """ JSON body of a vault file upload, the content of the file is read and base64 encoded one chunk at a time """
+        body = json.dumps({'container_id': container_id, 'file_name': vault_file['name'], 'file_content': ''})
+        # The content goes in between the quotes of the empty file_content string
+        yield body[:-2].encode('utf-8')
+        with open(vault_file['path'], 'rb') as f:
+            for chunk in iter(lambda: f.read(VAULT_TRANSFER_CHUNK_SIZE), b''):
+                yield base64.b64encode(chunk)
+        yield body[-2:].encode('utf-8')
+
+    def _transfer_vault_file(self, action_result, vault_file, destination, source, container_id):
+        """ Copy a vault file to the container of the destination instance, the file is streamed in chunks """
+
+        if not destination.local:
+            ret_val, response, resp_data = destination.rest_call('/rest/container_attachment', action_result, method='post',
+                                                                 body=self._iter_attachment_body(container_id, vault_file))
+            return ret_val
+
+        ret_val, response, resp_data = source.rest_call('/rest/download_attachment', action_result,
+                                                        params={'vault_id': vault_file['vault_id']}, stream=True)
+        if phantom.is_fail(ret_val):
+            return ret_val
+
+        with contextlib.closing(response):
+            response.raw.decode_content = True
+            ret_val, file_info, save_path = self._save_vault_tmp_file(response.raw, vault_file['name'])
+        if phantom.is_fail(ret_val):
+            return action_result.set_status(phantom.APP_ERROR, file_info)
+
+        if file_info['sha1'] != vault_file['vault_id']:
+            os.remove(save_path)
+            return action_result.set_status(phantom.APP_ERROR, "The content of vault file {} does not match its hash".format(vault_file['name']))
+
+        ret_val, message, vault_info = self._register_vault_file(save_path, vault_file['name'], container_id, file_info)
+        if phantom.is_fail(ret_val):
+            return action_result.set_status(phantom.APP_ERROR, message)
+
+        return phantom.APP_SUCCESS
+
+    def _copy_vault_files(self, action_result, container_id, new_container_id, destination, source):
+        """ Copy the vault files of the source container, skipping the ones already in the destination container.
+        Returns the status and the number of files copied and skipped.
+        """
+        ret_val, source_files = self._list_vault_files(action_result, source, container_id)
+        if phantom.is_fail(ret_val):
+            return ret_val, 0, 0
+
+        ret_val, destination_files = self._list_vault_files(action_result, destination, new_container_id)
+        if phantom.is_fail(ret_val):
+            return ret_val, 0, 0
+
+        existing_hashes = {vault_file['vault_id'] for vault_file in destination_files}
+        copied = skipped = 0
+
+        for vault_file in source_files:
+            if vault_file['vault_id'] in existing_hashes:
+                skipped += 1
+                continue
+
+            ret_val = self._transfer_vault_file(action_result, vault_file, destination, source, new_container_id)
+            if phantom.is_fail(ret_val):
+                return action_result.set_status(phantom.APP_ERROR, "Error copying vault file {0}: {1}".format(
+                                                vault_file['name'], action_result.get_message())), copied, skipped
+
+            existing_hashes.add(vault_file['vault_id'])
+            copied += 1
+
+        return phantom.APP_SUCCESS, copied, skipped
+
+    def _get_copy_checkpoint(self, checkpoint_key, state_key=CONTAINER_COPY_STATE_KEY):
+        with self._state_lock:
+            checkpoint = self._state.get(state_key, {}).get(checkpoint_key)
+            return dict(checkpoint) if checkpoint else None
+
+    def _set_copy_checkpoint(self, checkpoint_key, checkpoint, state_key=CONTAINER_COPY_STATE_KEY):
+        """ Save the progress of a container copy in the state, a checkpoint of None removes it """
+        with self._state_lock:
+            checkpoints = self._state.setdefault(state_key, {})
+            if checkpoint is None:
+                checkpoints.pop(checkpoint_key, None)
+            else:
+                checkpoints[checkpoint_key] = dict(checkpoint)
+            self.save_state(self._state)
+
+    def _check_copy_destination(self, action_result, checkpoint_key, checkpoint, state_key, destination):
+        """ Returns the checkpoint if its destination container still exists, a deleted one drops the checkpoint """
+        ret_val, response, resp_json = destination.rest_call('/rest/container/{}'.format(checkpoint['container_id']), action_result)
+
+        if phantom.is_success(ret_val):
+            return phantom.APP_SUCCESS, checkpoint
 
-        # Retrieve artifacts from old container
+        if response is not None and response.status_code == 404:
+            self.debug_print("Container {0} of the copy checkpoint was deleted, starting a new copy".format(checkpoint['container_id']))
+            self._set_copy_checkpoint(checkpoint_key, None, state_key)
+            return phantom.APP_SUCCESS, None
+
+        return action_result.get_status(), None
+
+    def _create_container_copy(self, action_result, container_id, destination, source, keep_owner=False, run_automation=True,
+                               label=None, chunk_size=DEFAULT_CHUNK_SIZE, resume=True, sync=False, copy_vault_files=False):
+        """ destination: client of the instance where new container is being made """
+        """ source: client of the instance where the original container is """
+        """ Create a copy of this existing container, including all of its artifacts """
+        """ sync: mirror the container, the artifacts added since the last sync are appended to the same copy """
+
+        # The progress of the copy is checkpointed in the state after every chunk,
+        # a copy that failed part way through is resumed from the last artifact copied.
+        # The checkpoints of the mirrored containers are kept once the copy is complete.
+        state_key = CONTAINER_SYNC_STATE_KEY if sync else CONTAINER_COPY_STATE_KEY
+        checkpoint_key = '{0}|{1}|{2}'.format(source.base_uri, destination.base_uri, container_id)
+        # A mirror always continues from its mapping, resume only applies to a plain copy
+        checkpoint = self._get_copy_checkpoint(checkpoint_key, state_key) if resume or sync else None
+        copied = 0
+
+        if checkpoint:
+            ret_val, checkpoint = self._check_copy_destination(action_result, checkpoint_key, checkpoint, state_key, destination)
+            if phantom.is_fail(ret_val):
+                return ret_val
+
+        resumed = checkpoint is not None
+
+        if not resumed:
+            ret_val, new_container_id = self._create_destination_container(action_result, container_id, destination, source,
+                                                                           keep_owner=keep_owner, label=label)
+            if phantom.is_fail(ret_val):
+                return ret_val
+
+            checkpoint = {'container_id': new_container_id, 'last_artifact_id': 0, 'artifact_count': 0}
+            self._set_copy_checkpoint(checkpoint_key, checkpoint, state_key)
+
+        new_container_id = checkpoint['container_id']
+        error_message = "Container created:{0}. {1}"
+
+        def _add_chunk(chunk, last_artifact_id):
+            nonlocal copied
+            ret_val, failed = destination.post_artifacts(action_result, chunk)
+            if phantom.is_fail(ret_val):
+                return action_result.set_status(phantom.APP_ERROR, error_message.format(
+                    new_container_id, "Error adding artifact: {}".format(action_result.get_message())))
+
+            # The artifacts that were rejected by the destination are not sent again on a retry,
+            # the ones that were added along with them would be duplicated
+            checkpoint['last_artifact_id'] = last_artifact_id
+            checkpoint['artifact_count'] += len(chunk) - failed
+            copied += len(chunk) - failed
+            self._set_copy_checkpoint(checkpoint_key, checkpoint, state_key)
+
+            if failed:
+                action_result.update_summary({'failed_artifact_count': failed})
+                return action_result.set_status(phantom.APP_ERROR, error_message.format(new_container_id, "Failed to add one or more artifacts"))
+            return phantom.APP_SUCCESS
+
+        # Copy the artifacts from the old container one page at a time, the next page is fetched from the source
+        # while the current one is added to the destination. A page is only added once the next one is known,
+        # so that the last artifact of the last page can be the one to run automation.
         url = '/rest/container/{}/artifacts'.format(container_id)
-        params = {'sort': 'id', 'order': 'asc', 'page_size': 0}
-        self._base_uri = source
-        ret_val, response, resp_data = self._make_rest_call(url, action_result, params=params, ignore_auth=source_local)
+        params = {'sort': 'id', 'order': 'asc'}
+        if checkpoint['last_artifact_id']:
+            params['_filter_id__gt'] = checkpoint['last_artifact_id']
+        pending = []
+        pending_last_id = None
 
-        artifacts = resp_data['data']
-        if artifacts:
-            for artifact in artifacts:
-                # Remove data from artifacts that we dont want
-                artifact.pop('update_time', None)
-                artifact.pop('create_time', None)
-                artifact.pop('start_time', None)
-                artifact.pop('end_time', None)
-                artifact.pop('asset_id', None)
-                artifact.pop('container', None)
-                artifact.pop('id', None)
-                artifact['run_automation'] = False
-                artifact['container_id'] = new_container_id
-                artifact['owner_id'] = artifact.pop('owner')
-            artifacts[-1]['run_automation'] = run_automation
+        for ret_val, artifacts in source.iter_pages(url, action_result, params=params, page_size=chunk_size):
 
-            self._base_uri = destination
-            ret_val = self._add_artifact_list(action_result, artifacts, ignore_auth=destination_local)
             if phantom.is_fail(ret_val):
-                return action_result.set_status(ret_val, "Container created:{0}. {1}".format(new_container_id, action_result.get_message()))
+                return action_result.set_status(ret_val, error_message.format(new_container_id, action_result.get_message()))
 
-        action_result.update_summary({'container_id': new_container_id, 'artifact_count': len(artifacts)})
+            if not artifacts:
+                continue
+
+            if pending:
+                ret_val = _add_chunk(pending, pending_last_id)
+                if phantom.is_fail(ret_val):
+                    return ret_val
+
+            pending_last_id = artifacts[-1]['id']
+            pending = [self._prepare_artifact_copy(artifact, new_container_id) for artifact in artifacts]
+
+        if pending:
+            pending[-1]['run_automation'] = run_automation
+
+            ret_val = _add_chunk(pending, pending_last_id)
+            if phantom.is_fail(ret_val):
+                return ret_val
+
+        # The vault files are copied last, a retry skips the ones that made it to the destination by their hash
+        if copy_vault_files:
+            ret_val, copied_files, skipped_files = self._copy_vault_files(action_result, container_id, new_container_id, destination, source)
+            action_result.update_summary({'vault_files_copied': copied_files, 'vault_files_skipped': skipped_files})
+            if phantom.is_fail(ret_val):
+                return action_result.set_status(ret_val, error_message.format(new_container_id, action_result.get_message()))
+
+        if not sync:
+            self._set_copy_checkpoint(checkpoint_key, None)
+
+        # A sync reports the artifacts appended by this run, a copy the artifacts of the whole container
+        artifact_count = copied if sync else checkpoint['artifact_count']
+        action_result.update_summary({'container_id': new_container_id, 'artifact_count': artifact_count, 'resumed': resumed})
         return action_result.set_status(phantom.APP_SUCCESS)
 
+    @staticmethod
+    def _prepare_artifact_copy(artifact, new_container_id):
+
+        # Remove data from artifacts that we dont want
+        artifact.pop('update_time', None)
+        artifact.pop('create_time', None)
+        artifact.pop('start_time', None)
+        artifact.pop('end_time', None)
+        artifact.pop('asset_id', None)
+        artifact.pop('container', None)
+        artifact.pop('id', None)
+        artifact['run_automation'] = False
+        artifact['container_id'] = new_container_id
+        artifact['owner_id'] = artifact.pop('owner')
+        return artifact
+
     def _create_container_new(self, action_result, container_json, artifact_json_list):
         try:
             container = json.loads(container_json)
@@ -1226,6 +2674,10 @@ class PhantomConnector(BaseConnector):
         else:
             artifacts = []
 
+        return self._add_new_container(action_result, container, artifacts)
+
+    def _add_new_container(self, action_result, container, artifacts, chunk_size=0):
+        """ Create a container and add its artifacts, chunk_size artifacts at a time (all at once if 0) """
         ret_val, response, resp_data = self._make_rest_call('/rest/container', action_result, method='post', data=container)
         if phantom.is_fail(ret_val):
             return ret_val
@@ -1236,15 +2688,18 @@ class PhantomConnector(BaseConnector):
             # The newly created container wont get cleaned up
             return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_UNABLE_RETRIEVE_ID)
 
+        action_result.update_summary({'container_id': new_container_id})
+
         if artifacts:
             for artifact in artifacts:
                 artifact['run_automation'] = False
                 artifact['container_id'] = new_container_id
             artifacts[-1]['run_automation'] = True
 
-            ret_val = self._add_artifact_list(action_result, artifacts)
-            if phantom.is_fail(ret_val):
-                return action_result.set_status(ret_val, "Container created:{0}. {1}".format(new_container_id, action_result.get_message()))
+            for chunk in self._iter_chunks(artifacts, chunk_size or len(artifacts)):
+                ret_val = self._add_artifact_list(action_result, chunk)
+                if phantom.is_fail(ret_val):
+                    return action_result.set_status(ret_val, "Container created:{0}. {1}".format(new_container_id, action_result.get_message()))
 
         action_result.update_summary({'container_id': new_container_id, 'artifact_count': len(artifacts)})
         return action_result.set_status(phantom.APP_SUCCESS)
@@ -1258,6 +2713,158 @@ class PhantomConnector(BaseConnector):
         container_artifacts = param.get('container_artifacts')
         return self._create_container_new(action_result, container_json, container_artifacts)
 
+    def _create_container_record(self, line, chunk_size):
+        """ Create the container of a line of a bulk creation file, reports to its own action result """
+        record_result = ActionResult()
+        try:
+            record = json.loads(line)
+            container = record.get('container') if isinstance(record, dict) else None
+            artifacts = (record.get('artifacts') or []) if isinstance(record, dict) else []
+        except ValueError as e:
+            record_result.set_status(phantom.APP_ERROR, "Invalid JSON: {}".format(self._get_error_message_from_exception(e)))
+            return record_result.get_status(), record_result
+
+        if not isinstance(container, dict):
+            return record_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_CONTAINER_RECORD), record_result
+        if not isinstance(artifacts, list) or not all(isinstance(artifact, dict) for artifact in artifacts):
+            return record_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_CONTAINER_ARTIFACT), record_result
+
+        try:
+            self._add_new_container(record_result, container, artifacts, chunk_size)
+        except Exception as e:
+            record_result.set_status(phantom.APP_ERROR, self._get_error_message_from_exception(e))
+
+        return record_result.get_status(), record_result
+
+    def _create_containers(self, param):
+
+        self.save_progress("In action handler for: {0}".format(self.get_action_identifier()))
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        ret_val, chunk_size = self._validate_integer(action_result, param.get('chunk_size', DEFAULT_CHUNK_SIZE), 'chunk_size', True)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        ret_val, max_workers = self._validate_integer(action_result, param.get('max_workers', DEFAULT_EXPORT_WORKERS), 'max_workers')
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        ret_val, vault_info = self._get_vault_item(action_result, param['vault_id'])
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        summary = action_result.update_summary({'record_count': 0, 'containers_created': 0, 'failed_record_count': 0, 'artifact_count': 0})
+
+        def _collect(line_number, future):
+            ret_val, record_result = future.result()
+            record_summary = record_result.get_summary()
+            summary['record_count'] += 1
+            if phantom.is_success(ret_val):
+                summary['containers_created'] += 1
+                summary['artifact_count'] += record_summary.get('artifact_count', 0)
+            else:
+                summary['failed_record_count'] += 1
+            action_result.add_data({
+                'line': line_number,
+                'status': 'success' if phantom.is_success(ret_val) else 'failed',
+                'container_id': record_summary.get('container_id'),
+                'artifact_count': record_summary.get('artifact_count', 0),
+                'message': record_result.get_message()
+            })
+
+        # The file is read as the records get created, only a couple of records per worker are in memory at a time
+        try:
+            with open(vault_info['path'], 'r') as f, ThreadPoolExecutor(max_workers=max_workers) as executor:
+                in_flight = deque()
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    in_flight.append((line_number, executor.submit(self._create_container_record, line, chunk_size)))
+                    if len(in_flight) >= 2 * max_workers:
+                        _collect(*in_flight.popleft())
+                while in_flight:
+                    _collect(*in_flight.popleft())
+        except Exception as e:
+            return action_result.set_status(phantom.APP_ERROR,
+                                            "Error reading the containers file: {}".format(self._get_error_message_from_exception(e)))
+
+        if summary['failed_record_count']:
+            return action_result.set_status(phantom.APP_ERROR,
+                                            PHANTOM_ERR_CREATE_CONTAINERS.format(summary['failed_record_count'], summary['record_count']))
+
+        return action_result.set_status(phantom.APP_SUCCESS)
+
+    @staticmethod
+    def _parse_container_ids(container_ids, current_container_id=None):
+        """ Parse a space or comma separated list of container ids, the word "current" is replaced by the current container id """
+        parsed_ids = []
+        for container_id in container_ids.replace(",", " ").split():
+            if container_id == "current":
+                container_id = current_container_id
+            if isinstance(container_id, int) or (container_id and container_id.isdigit()):
+                if int(container_id) and int(container_id) not in parsed_ids:
+                    parsed_ids.append(int(container_id))
+        return parsed_ids
+
+    def _find_container_ids(self, action_result, client, container_filter):
+        """ Retrieve the ids of the containers matching a REST filter, e.g. _filter_label="events"&_filter_status="new" """
+        endpoint = '/rest/container?{0}'.format(container_filter.strip().lstrip('?&'))
+        container_ids = []
+        for ret_val, containers in client.iter_pages(endpoint, action_result, params={'sort': 'id', 'order': 'asc'},
+                                                      page_size=DEFAULT_CHUNK_SIZE):
+            if phantom.is_fail(ret_val):
+                return action_result.set_status(phantom.APP_ERROR, "Error retrieving containers: {}".format(action_result.get_message())), None
+            container_ids.extend(container['id'] for container in containers)
+        return phantom.APP_SUCCESS, container_ids
+
+    def _copy_containers(self, action_result, container_ids, destination, source, max_workers=DEFAULT_EXPORT_WORKERS, **kwargs):
+        """ Copy a list of containers with a pool of workers, each copy reports to its own action result """
+
+        def _copy(container_id):
+            copy_result = ActionResult()
+            start_time = time.time()
+            try:
+                self._create_container_copy(copy_result, container_id, destination, source, **kwargs)
+            except Exception as e:
+                copy_result.set_status(phantom.APP_ERROR, self._get_error_message_from_exception(e))
+            return copy_result, time.time() - start_time
+
+        start_time = time.time()
+        succeeded = 0
+        artifact_count = 0
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(container_ids))) as executor:
+            for container_id, (copy_result, duration) in zip(container_ids, executor.map(_copy, container_ids)):
+                summary = copy_result.get_summary()
+                copied = summary.get('artifact_count', 0)
+                if phantom.is_success(copy_result.get_status()):
+                    succeeded += 1
+                    artifact_count += copied
+                action_result.add_data({
+                    'container_id': container_id,
+                    'new_container_id': summary.get('container_id'),
+                    'status': 'success' if phantom.is_success(copy_result.get_status()) else 'failed',
+                    'message': copy_result.get_message(),
+                    'artifact_count': copied,
+                    'resumed': summary.get('resumed', False),
+                    'duration': round(duration, 3),
+                    'artifacts_per_second': round(copied / duration, 2) if duration else copied
+                })
+
+        duration = time.time() - start_time
+        action_result.update_summary({
+            'container_count': len(container_ids),
+            'containers_succeeded': succeeded,
+            'containers_failed': len(container_ids) - succeeded,
+            'artifact_count': artifact_count,
+            'artifacts_per_second': round(artifact_count / duration, 2) if duration else artifact_count
+        })
+
+        if succeeded < len(container_ids):
+            return action_result.set_status(phantom.APP_ERROR,
+                                            PHANTOM_ERR_CONTAINER_COPY.format(len(container_ids) - succeeded, len(container_ids)))
+        return action_result.set_status(phantom.APP_SUCCESS)
+
     def _export_container(self, param):
 
         self.save_progress("In action handler for: {0}".format(self.get_action_identifier()))
@@ -1265,19 +2872,95 @@ class PhantomConnector(BaseConnector):
         label = param.get('label')
         run_automation = param.get('run_automation', False)
 
+        ret_val, chunk_size = self._validate_integer(action_result, param.get('chunk_size', DEFAULT_CHUNK_SIZE), 'chunk_size', True)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        ret_val, max_workers = self._validate_integer(action_result, param.get('max_workers', DEFAULT_EXPORT_WORKERS), 'max_workers')
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        destination = PhantomClient(self, self._base_uri)
+        source = PhantomClient(self, self.get_phantom_base_url(), local=True)
+
+        container_ids = self._parse_container_ids(param.get('container_ids', ''), self.get_container_id())
+        container_filter = param.get('container_filter')
+
+        container_id = param.get('container_id')
+        if container_id is not None:
+            ret_val, container_id = self._validate_integer(action_result, container_id, 'container_id')
+            if phantom.is_fail(ret_val):
+                return action_result.get_status()
+
+            # A single container keeps the result format of a single copy
+            if not container_ids and not container_filter:
+                return self._create_container_copy(action_result, container_id, destination, source,
+                            keep_owner=param.get('keep_owner', False), run_automation=run_automation, label=label,
+                            chunk_size=chunk_size, resume=param.get('resume', True), sync=param.get('sync', False),
+                            copy_vault_files=param.get('copy_vault_files', False))
+
+            container_ids.insert(0, container_id)
+
+        if container_filter:
+            ret_val, filtered_ids = self._find_container_ids(action_result, source, container_filter)
+            if phantom.is_fail(ret_val):
+                return action_result.get_status()
+            container_ids.extend(filtered_ids)
+
+        # The same container could be listed more than once
+        container_ids = list(dict.fromkeys(container_ids))
+        if not container_ids:
+            return action_result.set_status(phantom.APP_ERROR, PHANTOM_ERR_NO_CONTAINERS)
+
+        return self._copy_containers(action_result, container_ids, destination, source, max_workers=max_workers,
+                    keep_owner=param.get('keep_owner', False), run_automation=run_automation, label=label,
+                    chunk_size=chunk_size, resume=param.get('resume', True), sync=param.get('sync', False),
+                    copy_vault_files=param.get('copy_vault_files', False))
+
+    def _import_container(self, param):
+
+        self.save_progress("In action handler for: {0}".format(self.get_action_identifier()))
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
         container_id = param.get('container_id')
         ret_val, container_id = self._validate_integer(action_result, container_id, 'container_id')
         if phantom.is_fail(ret_val):
             return action_result.get_status()
 
-        destination = self._base_uri
-        source = self.get_phantom_base_url()
+        ret_val, chunk_size = self._validate_integer(action_result, param.get('chunk_size', DEFAULT_CHUNK_SIZE), 'chunk_size', True)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        destination = PhantomClient(self, self.get_phantom_base_url(), local=True)
+        source = PhantomClient(self, self._base_uri)
 
-        return self._create_container_copy(action_result, container_id, destination,
-                    source, source_local=True, keep_owner=param.get('keep_owner', False),
-                    run_automation=run_automation, label=label)
+        return self._create_container_copy(action_result, container_id, destination, source,
+                keep_owner=param.get('keep_owner', False), chunk_size=chunk_size, resume=param.get('resume', True),
+                sync=param.get('sync', False), copy_vault_files=param.get('copy_vault_files', False))
 
-    def _import_container(self, param):
+    @staticmethod
+    def _file_sha256(file_object):
+        sha256 = hashlib.sha256()
+        for chunk in iter(lambda: file_object.read(DEFLATE_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _write_ndjson_gz(self, action_result, client, endpoint, file_path, page_size):
+        """ Write the records of a REST listing to a gzip compressed file with one JSON object per line.
+        Returns the status and the number of records written.
+        """
+        count = 0
+        with gzip.open(file_path, 'wt', encoding='utf-8') as f:
+            for ret_val, records in client.iter_pages(endpoint, action_result, params={'sort': 'id', 'order': 'asc'}, page_size=page_size):
+                if phantom.is_fail(ret_val):
+                    return ret_val, count
+                for record in records:
+                    f.write(json.dumps(record))
+                    f.write('\n')
+                count += len(records)
+        return phantom.APP_SUCCESS, count
+
+    def _archive_container(self, param):
 
         self.save_progress("In action handler for: {0}".format(self.get_action_identifier()))
         action_result = self.add_action_result(ActionResult(dict(param)))
@@ -1287,11 +2970,198 @@ class PhantomConnector(BaseConnector):
         if phantom.is_fail(ret_val):
             return action_result.get_status()
 
-        destination = self.get_phantom_base_url()
-        source = self._base_uri
+        ret_val, chunk_size = self._validate_integer(action_result, param.get('chunk_size', DEFAULT_CHUNK_SIZE), 'chunk_size', True)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        vault_container_id = param.get('vault_container_id', self.get_container_id())
+        ret_val, vault_container_id = self._validate_integer(action_result, vault_container_id, 'vault_container_id')
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        source = PhantomClient(self, self.get_phantom_base_url(), local=True)
+
+        ret_val, response, container = source.rest_call('/rest/container/{}'.format(container_id), action_result)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        manifest = {
+            'format': ARCHIVE_FORMAT,
+            'version': ARCHIVE_VERSION,
+            'created': datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+            'source': source.base_uri,
+            'container_id': container_id,
+            'members': {},
+            'vault_files': []
+        }
+
+        work_dir = tempfile.mkdtemp(dir=self._get_vault_tmp_dir())
+        try:
+            # The members are compressed on their own, so the archive can be read back one member at a time
+            with open(os.path.join(work_dir, ARCHIVE_CONTAINER), 'w') as f:
+                json.dump(container, f)
+
+            ret_val, manifest['artifact_count'] = self._write_ndjson_gz(action_result, source,
+                    '/rest/container/{}/artifacts'.format(container_id), os.path.join(work_dir, ARCHIVE_ARTIFACTS), chunk_size)
+            if phantom.is_fail(ret_val):
+                return action_result.set_status(phantom.APP_ERROR, "Error retrieving artifacts: {}".format(action_result.get_message()))
+
+            members = [ARCHIVE_CONTAINER, ARCHIVE_ARTIFACTS]
+
+            if param.get('include_notes', False):
+                ret_val, manifest['note_count'] = self._write_ndjson_gz(action_result, source,
+                        '/rest/container/{}/notes'.format(container_id), os.path.join(work_dir, ARCHIVE_NOTES), chunk_size)
+                if phantom.is_fail(ret_val):
+                    return action_result.set_status(phantom.APP_ERROR, "Error retrieving notes: {}".format(action_result.get_message()))
+                members.append(ARCHIVE_NOTES)
+
+            vault_files = []
+            if param.get('include_vault_files', False):
+                try:
+                    success, message, vault_files = ph_rules.vault_info(container_id=container_id)
+                    vault_files = list(vault_files) if success and vault_files else []
+                except Exception as e:
+                    return action_result.set_status(phantom.APP_ERROR,
+                                                    PHANTOM_ERR_GET_VAULT_INFO.format(self._get_error_message_from_exception(e)))
+
+            for member in members:
+                with open(os.path.join(work_dir, member), 'rb') as f:
+                    manifest['members'][member] = {'sha256': self._file_sha256(f), 'size': os.path.getsize(os.path.join(work_dir, member))}
+
+            for index, vault_file in enumerate(vault_files):
+                with open(vault_file['path'], 'rb') as f:
+                    manifest['vault_files'].append({
+                        'member': '{0}/{1}'.format(ARCHIVE_VAULT_DIR, index),
+                        'name': vault_file['name'],
+                        'sha256': self._file_sha256(f),
+                        'size': os.path.getsize(vault_file['path'])
+                    })
+
+            # The manifest comes first, it tells the import what to expect before any data is read
+            archive_name = 'container_{0}_archive.tar'.format(container_id)
+            archive_path = os.path.join(work_dir, archive_name)
+            with tarfile.open(archive_path, 'w') as tar:
+                manifest_data = json.dumps(manifest, indent=2).encode('utf-8')
+                tarinfo = tarfile.TarInfo(ARCHIVE_MANIFEST)
+                tarinfo.size = len(manifest_data)
+                tarinfo.mtime = int(time.time())
+                tar.addfile(tarinfo, io.BytesIO(manifest_data))
+                for member in members:
+                    tar.add(os.path.join(work_dir, member), arcname=member)
+                for vault_file, archived_file in zip(vault_files, manifest['vault_files']):
+                    tar.add(vault_file['path'], arcname=archived_file['member'])
+
+            archive_size = os.path.getsize(archive_path)
+            success, message, vault_id = ph_rules.vault_add(container=vault_container_id, file_location=archive_path, file_name=archive_name)
+            if not success:
+                return action_result.set_status(phantom.APP_ERROR, "Failed to add file into vault: {0}".format(message))
+
+        except Exception as e:
+            return action_result.set_status(phantom.APP_ERROR,
+                                            "Error creating the container archive: {}".format(self._get_error_message_from_exception(e)))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        action_result.add_data({'vault_id': vault_id, 'file_name': archive_name, 'size': archive_size})
+        action_result.update_summary({
+            'vault_id': vault_id,
+            'artifact_count': manifest['artifact_count'],
+            'note_count': manifest.get('note_count', 0),
+            'vault_file_count': len(manifest['vault_files'])
+        })
+
+        return action_result.set_status(phantom.APP_SUCCESS)
+
+    def _open_archive_member(self, tar, name, expected):
+        """ Open a member of a container archive, after checking it against the manifest """
+        try:
+            member = tar.getmember(name)
+        except KeyError:
+            raise ValueError(PHANTOM_ERR_INVALID_ARCHIVE.format("{} is missing".format(name)))
+
+        if member.size != expected['size'] or self._file_sha256(tar.extractfile(member)) != expected['sha256']:
+            raise ValueError(PHANTOM_ERR_INVALID_ARCHIVE.format("{} does not match the manifest".format(name)))
 
-        return self._create_container_copy(action_result, container_id, destination,
-                source, destination_local=True, keep_owner=param.get('keep_owner', False))
+        return tar.extractfile(member)
+
+    def _restore_container(self, param):
+
+        self.save_progress("In action handler for: {0}".format(self.get_action_identifier()))
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        run_automation = param.get('run_automation', False)
+
+        ret_val, chunk_size = self._validate_integer(action_result, param.get('chunk_size', DEFAULT_CHUNK_SIZE), 'chunk_size')
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        ret_val, vault_info = self._get_vault_item(action_result, param['vault_id'])
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        destination = PhantomClient(self, self.get_phantom_base_url(), local=True)
+        new_container_id = None
+        summary = action_result.update_summary({'artifact_count': 0, 'note_count': 0, 'vault_file_count': 0})
+
+        try:
+            with tarfile.open(vault_info['path'], 'r:') as tar:
+
+                try:
+                    manifest = json.load(tar.extractfile(ARCHIVE_MANIFEST))
+                except KeyError:
+                    raise ValueError(PHANTOM_ERR_INVALID_ARCHIVE.format("the manifest is missing"))
+
+                if manifest.get('format') != ARCHIVE_FORMAT or manifest.get('version') != ARCHIVE_VERSION:
+                    raise ValueError(PHANTOM_ERR_INVALID_ARCHIVE.format("unsupported format"))
+
+                members = manifest['members']
+                container = json.load(self._open_archive_member(tar, ARCHIVE_CONTAINER, members[ARCHIVE_CONTAINER]))
+                container = self._prepare_container_copy(container, True, keep_owner=param.get('keep_owner', False), label=param.get('label'))
+
+                ret_val, new_container_id = self._post_container(action_result, destination, container)
+                if phantom.is_fail(ret_val):
+                    return action_result.get_status()
+                summary['container_id'] = new_container_id
+
+                # The artifacts are loaded in chunks, only the very last one triggers the active playbooks
+                artifacts = self._parse_ndjson(io.TextIOWrapper(gzip.GzipFile(
+                    fileobj=self._open_archive_member(tar, ARCHIVE_ARTIFACTS, members[ARCHIVE_ARTIFACTS])), encoding='utf-8'))
+                chunks = self._iter_chunks((self._prepare_artifact_copy(artifact, new_container_id) for artifact in artifacts), chunk_size)
+                for ret_val, chunk, failed in destination.post_artifact_chunks(action_result, chunks, run_automation):
+                    if phantom.is_fail(ret_val) or failed:
+                        return action_result.set_status(phantom.APP_ERROR, "Container created:{0}. Error adding artifacts: {1}".format(
+                                                        new_container_id, action_result.get_message() or "Failed to add one or more artifacts"))
+                    summary['artifact_count'] += len(chunk)
+
+                if ARCHIVE_NOTES in members:
+                    notes = self._parse_ndjson(io.TextIOWrapper(gzip.GzipFile(
+                        fileobj=self._open_archive_member(tar, ARCHIVE_NOTES, members[ARCHIVE_NOTES])), encoding='utf-8'))
+                    for note in notes:
+                        note_data = {'container_id': new_container_id, 'title': note.get('title', ''),
+                                     'content': note.get('content', ''), 'note_type': 'general'}
+                        ret_val, response, resp_data = destination.rest_call('/rest/note', action_result, method='post', data=note_data)
+                        if phantom.is_fail(ret_val):
+                            return action_result.set_status(phantom.APP_ERROR, "Container created:{0}. Failed to create note: {1}".format(
+                                                            new_container_id, action_result.get_message()))
+                        summary['note_count'] += 1
+
+                for archived_file in manifest.get('vault_files', []):
+                    data_stream = self._open_archive_member(tar, archived_file['member'], archived_file)
+                    ret_val, details, save_path = self._save_vault_tmp_file(data_stream, archived_file['name'])
+                    if phantom.is_fail(ret_val):
+                        return action_result.set_status(phantom.APP_ERROR, "Container created:{0}. {1}".format(new_container_id, details))
+                    ret_val, message, vault_file_info = self._register_vault_file(save_path, archived_file['name'], new_container_id, details)
+                    if phantom.is_fail(ret_val):
+                        return action_result.set_status(phantom.APP_ERROR, "Container created:{0}. {1}".format(new_container_id, message))
+                    summary['vault_file_count'] += 1
+
+        except Exception as e:
+            message = self._get_error_message_from_exception(e)
+            if new_container_id:
+                message = "Container created:{0}. {1}".format(new_container_id, message)
+            return action_result.set_status(phantom.APP_ERROR, "Error restoring the container archive: {}".format(message))
+
+        return action_result.set_status(phantom.APP_SUCCESS)
 
     def _get_action(self, param):
 
@@ -1339,33 +3209,20 @@ class PhantomConnector(BaseConnector):
 
             url_params['page_size'] = limit
 
-        if 'app' in param:
+        # The app and the asset do not depend on each other, so they are looked up concurrently
+        lookups = [(key, param.get(key)) for key in ('app', 'asset') if key in param]
+        responses = self._make_rest_calls(action_result, [('/rest/{}'.format(key), {'params': {'_filter_name__iexact': '"{0}"'.format(name)}})
+                                                          for key, name in lookups])
 
-            app_name = param.get('app')
-            app_params = {'_filter_name__iexact': '"{0}"'.format(app_name)}
-            ret_val, response, resp_json = self._make_rest_call('/rest/app', action_result, params=app_params)
+        for (key, name), (ret_val, response, resp_json) in zip(lookups, responses):
 
             if phantom.is_fail(ret_val):
                 return ret_val
 
             if resp_json['count'] == 0:
-                return action_result.set_status(phantom.APP_ERROR, "Could not find app with name '{0}'".format(app_name))
-
-            url_params['_filter_app'] = resp_json['data'][0]['id']
+                return action_result.set_status(phantom.APP_ERROR, "Could not find {0} with name '{1}'".format(key, name))
 
-        if 'asset' in param:
-
-            asset = param.get('asset')
-            asset_params = {'_filter_name__iexact': '"{0}"'.format(asset)}
-            ret_val, response, resp_json = self._make_rest_call('/rest/asset', action_result, params=asset_params)
-
-            if phantom.is_fail(ret_val):
-                return ret_val
-
-            if resp_json['count'] == 0:
-                return action_result.set_status(phantom.APP_ERROR, "Could not find asset with name '{0}'".format(asset))
-
-            url_params['_filter_asset'] = resp_json['data'][0]['id']
+            url_params['_filter_{}'.format(key)] = resp_json['data'][0]['id']
 
         ret_val, response, resp_json = self._make_rest_call('/rest/app_run', action_result, params=url_params)
 
@@ -1540,9 +3397,160 @@ class PhantomConnector(BaseConnector):
             self._auth = (config.get('username'), config.get('password'))
 
         self._level = 0
+        self._deflate_budget = None
+        self._deflate_queue = deque()
+        self._deduplicate = False
+        self._vault_intermediate_tar = False
+        self._vault_hashes = {}
+        self._vault_hashes_lock = threading.Lock()
+        self._decided_list_cache = config.get('decided_list_cache', False)
+
+        ret_val, self._deflate_workers = self._validate_integer(self, config.get('deflate_workers', DEFAULT_DEFLATE_WORKERS),
+                                                                'deflate_workers', err_msg=PHANTOM_ERR_INVALID_CONFIG_INT)
+        if phantom.is_fail(ret_val):
+            return ret_val
+
+        self._deflate_limits = {}
+        for limit in ('max_depth', 'max_bytes', 'max_files', 'max_ratio'):
+            key = 'deflate_{}'.format(limit)
+            ret_val, self._deflate_limits[limit] = self._validate_integer(self, config.get(key, 0), key, True,
+                                                                          err_msg=PHANTOM_ERR_INVALID_CONFIG_INT)
+            if phantom.is_fail(ret_val):
+                return ret_val
+
+        ret_val = self._load_debug_capture_config(config)
+        if phantom.is_fail(ret_val):
+            return ret_val
+
+        ret_val = self._load_retry_config(config)
+        if phantom.is_fail(ret_val):
+            return ret_val
+
+        self._load_metrics_config(config)
+
+        ret_val = self._create_session(config)
+        if phantom.is_fail(ret_val):
+            return ret_val
+
+        self._state = self.load_state() or {}
+        self._state_lock = threading.Lock()
+
+        self._load_session_auth(config)
 
         return (phantom.APP_SUCCESS)
 
+    def _load_retry_config(self, config):
+
+        ret_val, self._max_retries = self._validate_integer(self, config.get('max_retries', DEFAULT_MAX_RETRIES), 'max_retries', True,
+                                                            err_msg=PHANTOM_ERR_INVALID_CONFIG_INT)
+        if phantom.is_fail(ret_val):
+            return ret_val
+
+        ret_val, max_concurrent_requests = self._validate_integer(self,
+                config.get('max_concurrent_requests', DEFAULT_MAX_CONCURRENT_REQUESTS), 'max_concurrent_requests', True,
+                err_msg=PHANTOM_ERR_INVALID_CONFIG_INT)
+        if phantom.is_fail(ret_val):
+            return ret_val
+
+        self._limiter = AdaptiveLimiter(max_concurrent_requests)
+
+        return phantom.APP_SUCCESS
+
+    def _load_metrics_config(self, config):
+
+        self._rest_metrics_summary = config.get('rest_metrics_summary', False)
+        self._prometheus_textfile_dir = config.get('prometheus_textfile_dir')
+
+        # The metrics of the whole run, and of the action currently handled
+        self._run_metrics = RestMetrics() if self._rest_metrics_summary or self._prometheus_textfile_dir else None
+        self._metrics = self._run_metrics
+
+    def _write_prometheus_textfile(self):
+        """ Write the metrics of the run for the node exporter textfile collector, replacing the file of the previous run """
+        action = self.get_action_identifier()
+        labels = {
+            'app_version': self.get_app_json().get('app_version', ''),
+            'asset_id': self.get_asset_id(),
+            'action': action
+        }
+        path = os.path.join(self._prometheus_textfile_dir, 'phantom_app_{0}_{1}.prom'.format(self.get_asset_id(), action))
+
+        try:
+            # The collector must never read a partially written file
+            fd, tmp_path = tempfile.mkstemp(dir=self._prometheus_textfile_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(self._run_metrics.to_prometheus(labels))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            self.debug_print("Unable to write the metrics to {0}: {1}".format(path, self._get_error_message_from_exception(e)))
+
+    def _load_debug_capture_config(self, config):
+
+        self._debug_capture = config.get('debug_capture', DEBUG_CAPTURE_ALL)
+        if self._debug_capture not in DEBUG_CAPTURE_POLICIES:
+            return self.set_status(phantom.APP_ERROR, PHANTOM_ERR_INVALID_DEBUG_CAPTURE.format(', '.join(DEBUG_CAPTURE_POLICIES)))
+
+        ret_val, self._debug_capture_max_bytes = self._validate_integer(self,
+                config.get('debug_capture_max_bytes', DEFAULT_DEBUG_CAPTURE_MAX_BYTES), 'debug_capture_max_bytes',
+                err_msg=PHANTOM_ERR_INVALID_CONFIG_INT)
+        if phantom.is_fail(ret_val):
+            return ret_val
+
+        ret_val, self._debug_capture_sample_rate = self._validate_integer(self,
+                config.get('debug_capture_sample_rate', DEFAULT_DEBUG_CAPTURE_SAMPLE_RATE), 'debug_capture_sample_rate', True,
+                err_msg=PHANTOM_ERR_INVALID_CONFIG_INT)
+        if phantom.is_fail(ret_val):
+            return ret_val
+
+        if self._debug_capture_sample_rate > 100:
+            return self.set_status(phantom.APP_ERROR, PHANTOM_ERR_INVALID_SAMPLE_RATE)
+
+        return phantom.APP_SUCCESS
+
+    def _create_session(self, config):
+        """ Create the HTTP session shared by every REST call of this action run.
+        Reusing the session keeps the TCP/TLS connections to the server alive between calls.
+        """
+        ret_val, pool_size = self._validate_integer(self, config.get('connection_pool_size', DEFAULT_CONNECTION_POOL_SIZE),
+                                                    'connection_pool_size', err_msg=PHANTOM_ERR_INVALID_CONFIG_INT)
+        if phantom.is_fail(ret_val):
+            return ret_val
+
+        self._session = requests.Session()
+        # pool_connections is the number of hosts to keep pools for, export/import talk to two of them
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+        if not config.get('keep_alive', True):
+            self._session.headers['Connection'] = 'close'
+
+        # The responses are decompressed by requests as they are read
+        self._session.headers['Accept-Encoding'] = 'gzip, deflate' if config.get('compress_responses', True) else 'identity'
+
+        self._gzip_requests = config.get('gzip_requests', False)
+        ret_val, self._gzip_min_size = self._validate_integer(self, config.get('gzip_min_size', DEFAULT_GZIP_MIN_SIZE), 'gzip_min_size', True,
+                                                              err_msg=PHANTOM_ERR_INVALID_CONFIG_INT)
+        if phantom.is_fail(ret_val):
+            return ret_val
+
+        return phantom.APP_SUCCESS
+
+    def finalize(self):
+
+        if getattr(self, '_run_metrics', None) is not None and self._prometheus_textfile_dir:
+            self._write_prometheus_textfile()
+
+        session = getattr(self, '_session', None)
+        if session is not None:
+            session.close()
+
+        state = getattr(self, '_state', None)
+        if state is not None:
+            self.save_state(state)
+
+        return phantom.APP_SUCCESS
+
     def handle_action(self, param):
         """Function that handles all the actions
 
@@ -1552,6 +3560,23 @@ class PhantomConnector(BaseConnector):
             A status code
         """
 
+        if self._run_metrics is None:
+            return self._dispatch_action(param)
+
+        self._metrics = RestMetrics()
+        action_results_count = len(self.get_action_results())
+        try:
+            return self._dispatch_action(param)
+        finally:
+            self._run_metrics.merge(self._metrics)
+            if self._rest_metrics_summary:
+                rest_metrics = self._metrics.summary()
+                for action_result in self.get_action_results()[action_results_count:]:
+                    action_result.update_summary({'rest_metrics': rest_metrics})
+            self._metrics = self._run_metrics
+
+    def _dispatch_action(self, param):
+
         result = None
         action = self.get_action_identifier()
 
@@ -1559,6 +3584,8 @@ class PhantomConnector(BaseConnector):
             result = self._find_artifacts(param)
         elif action == 'add_artifact':
             result = self._add_artifact(param)
+        elif action == 'add_artifacts':
+            result = self._add_artifacts(param)
         elif action == 'add_listitem':
             result = self._add_listitem(param)
         elif action == 'find_listitem':
@@ -1569,10 +3596,16 @@ class PhantomConnector(BaseConnector):
             result = self._test_connectivity(param)
         elif action == 'create_container':
             result = self._create_container(param)
+        elif action == 'create_containers':
+            result = self._create_containers(param)
         elif action == 'export_container':
             result = self._export_container(param)
         elif action == 'import_container':
             result = self._import_container(param)
+        elif action == 'archive_container':
+            result = self._archive_container(param)
+        elif action == 'restore_container':
+            result = self._restore_container(param)
         elif action == 'get_action':
             result = self._get_action(param)
         elif action == 'update_list':
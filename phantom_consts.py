@@ -14,6 +14,60 @@
 # and limitations under the License.
 TIMEOUT = 120
 INVALID_RESPONSE = 'Server did not return a valid JSON response.'
+DEFAULT_CONNECTION_POOL_SIZE = 10
+DEFAULT_GZIP_MIN_SIZE = 16384
+GZIP_COMPRESS_LEVEL = 6
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_EXPORT_WORKERS = 4
+
+# Retries of the REST requests the server turned away
+RETRY_METHODS = ['get', 'head', 'options', 'put', 'delete']
+RETRY_STATUS_CODES = [429, 503]
+DEFAULT_MAX_RETRIES = 3
+RETRY_BACKOFF_BASE = 1
+RETRY_MAX_DELAY = 60
+DEFAULT_MAX_CONCURRENT_REQUESTS = 10
+LIMITER_LATENCY_THRESHOLD = 5
+
+# Upper bounds in seconds of the latency histogram buckets of the REST metrics
+REST_LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+# Session auth, the seconds a session is assumed to last when the server does not say
+SESSION_AUTH_STATE_KEY = "session_auth"
+SESSION_AUTH_SECRET_KEYS = ["sessionid", "csrftoken"]
+DEFAULT_SESSION_LIFETIME = 3600
+SESSION_EXPIRY_MARGIN = 60
+
+DECIDED_LIST_CACHE_DIR = "decided_list_cache"
+# Values looked up with a single query of the custom list index, below the SQLite limit of query parameters
+DECIDED_LIST_LOOKUP_BATCH_SIZE = 500
+CONTAINER_COPY_STATE_KEY = "container_copies"
+CONTAINER_SYNC_STATE_KEY = "container_mirrors"
+
+# Container archive layout
+ARCHIVE_FORMAT = "phantom_container_archive"
+ARCHIVE_VERSION = 1
+ARCHIVE_MANIFEST = "manifest.json"
+ARCHIVE_CONTAINER = "container.json"
+ARCHIVE_ARTIFACTS = "artifacts.ndjson.gz"
+ARCHIVE_NOTES = "notes.ndjson.gz"
+ARCHIVE_VAULT_DIR = "vault"
+DETERMINE_CONTAINS_CACHE_SIZE = 4096
+
+# contains whose validators are skipped for values that can not match them
+HASH_CONTAINS = ['hash', 'md5', 'sha1', 'sha256', 'sha512']
+HASH_LENGTHS = [32, 40, 64, 128]
+IP_CONTAINS = ['ip', 'ipv6']
+
+# Debug capture policies of the REST responses
+DEBUG_CAPTURE_ALL = "all"
+DEBUG_CAPTURE_ERRORS_ONLY = "errors only"
+DEBUG_CAPTURE_TRUNCATED = "truncated"
+DEBUG_CAPTURE_SAMPLED = "sampled"
+DEBUG_CAPTURE_OFF = "off"
+DEBUG_CAPTURE_POLICIES = [DEBUG_CAPTURE_ALL, DEBUG_CAPTURE_ERRORS_ONLY, DEBUG_CAPTURE_TRUNCATED, DEBUG_CAPTURE_SAMPLED, DEBUG_CAPTURE_OFF]
+DEFAULT_DEBUG_CAPTURE_MAX_BYTES = 4096
+DEFAULT_DEBUG_CAPTURE_SAMPLE_RATE = 10
 
 OPEN_XML_FORMATS = [
     "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
@@ -24,10 +78,19 @@ OPEN_XML_FORMATS = [
 ]
 
 # list of file types supported for deflation
+# tarfile compression of the file types which can be compressed tarballs
+COMPRESSED_TAR_TYPES = {'application/x-gzip': 'gz', 'application/gzip': 'gz', 'application/x-bzip2': 'bz2'}
+DEFLATE_CHUNK_SIZE = 1024 * 1024
+# Multiple of 3, so the base64 encoded chunks of a vault file can be concatenated
+VAULT_TRANSFER_CHUNK_SIZE = 768 * 1024
+DEFAULT_DEFLATE_WORKERS = 1
 SUPPORTED_FILES = ['application/zip', 'application/x-gzip', 'application/x-tar', 'application/x-bzip2', 'application/gzip']
 
 # Consts for error messages
 PHANTOM_ERR_INVALID_INT = "Please provide a valid {msg} integer value in the '{param}' action parameter"
+PHANTOM_ERR_INVALID_DEBUG_CAPTURE = "Please provide one of the following values in the 'debug_capture' asset configuration parameter: {}"
+PHANTOM_ERR_INVALID_CONFIG_INT = "Please provide a valid {msg} integer value in the '{param}' asset configuration parameter"
+PHANTOM_ERR_INVALID_SAMPLE_RATE = "Please provide a value between 0 and 100 in the 'debug_capture_sample_rate' asset configuration parameter"
 PHANTOM_ERR_CODE_UNAVAILABLE = "Error code unavailable"
 PHANTOM_ERR_MSG_UNAVAILABLE = "Unknown error occurred. Please check the asset configuration and|or action parameters."
 PHANTOM_ERR_PARSE_JSON_RESPONSE = "Unable to parse response as JSON: {}"
@@ -35,12 +98,22 @@ PHANTOM_ERR_SERVER = "Error from server. Status code: {0}, Details: {1}"
 PHANTOM_ERR_FIND_ARTIFACT = "Unable to find artifact, please check the artifact id."
 PHANTOM_ERR_GET_ARTIFACT = "Failed to get artifact: {}"
 PHANTOM_ERR_UPDATE_ARTIFACT = "Failed to update artifact: {}"
+PHANTOM_ERR_DEFLATE_BUDGET = "Deflation stopped early, {0}. {1} file(s) were added to the vault"
 PHANTOM_ERR_DECOMPRESSING_FILE = "Error decompressing {0} file. Details: {1}"
 PHANTOM_ERR_FILE_PATH_NOT_FOUND = "File path not found. Please check that the asset is pointing to the current(self) Phantom instance."
 PHANTOM_ERR_CONTAINER_ARTIFACT = "Please provide container_artifacts as a list of artifact objects in JSON format"
+PHANTOM_ERR_ARTIFACTS_LIST = "Please provide the artifacts as a list of artifact objects in JSON format"
+PHANTOM_ERR_ARTIFACTS_SOURCE = "Please provide exactly one of the artifacts_json and vault_id action parameters"
+PHANTOM_ERR_NO_CONTAINERS = "Please provide the container_id, container_ids or container_filter parameter"
+PHANTOM_ERR_CONTAINER_RECORD = "Please provide the container of each record as a JSON formatted dictionary in the container key"
+PHANTOM_ERR_CREATE_CONTAINERS = "Failed to create {0} of {1} containers"
+PHANTOM_ERR_CONTAINER_COPY = "Failed to copy {0} of {1} containers"
+PHANTOM_ERR_INVALID_ARCHIVE = "Invalid container archive, {0}"
+PHANTOM_ERR_SESSION_LOGIN = "Unable to log in to the Phantom server, {0}"
 PHANTOM_ERR_UNABLE_RETRIEVE_ID = "Unable to retrieve ID of newly created container"
 PHANTOM_ERR_ACTION_RESULT_NOT_FOUND = "No action results found matching given criteria"
 PHANTOM_ERR_NON_EMPTY_PARAM_VALUE = "Please provide row_values_as_list parameter as a non-empty JSON formatted list"
+PHANTOM_ERR_EMPTY_VALUES_LIST = "Please provide a non-empty JSON formatted list in the values parameter"
 PHANTOM_ERR_SPECIFY_IP_HOSTNAME = ("Accessing 127.0.0.1 is not allowed."
 " Please specify the actual IP or hostname used by the Phantom instance in the Asset config")
 PHANTOM_ERR_GET_VAULT_INFO = "Failed to get the vault info: {}"
@@ -0,0 +1,20 @@
+# File: conftest.py
+#
+# Copyright (c) 2016-2024 Splunk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+import os
+import sys
+
+
+# The connector is a top level module of the app directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,143 @@
+# File: test_deflate_item.py
+#
+# Copyright (c) 2016-2024 Splunk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+
+import pytest
+
+pytest.importorskip('phantom.app')
+
+import phantom_connector  # noqa: E402
+
+
+class FakeVault(object):
+    """ In memory stand-in of the vault rules used by deflate item """
+
+    def __init__(self, vault_dir):
+        self.vault_dir = vault_dir
+        self.items = []
+        self.add_delay = 0
+        self._lock = threading.Lock()
+
+    def store(self, path, name, container=None):
+        with open(path, 'rb') as f:
+            data = f.read()
+        vault_id = hashlib.sha1(data).hexdigest()
+        dest = os.path.join(self.vault_dir, '{0}_{1}'.format(vault_id, len(self.items)))
+        shutil.move(path, dest)
+        item = {'vault_id': vault_id, 'name': name, 'path': dest, 'container': container, 'size': len(data),
+                'metadata': {'sha256': hashlib.sha256(data).hexdigest()}}
+        with self._lock:
+            self.items.append(item)
+        return item
+
+    def vault_add(self, container=None, file_location=None, file_name=None):
+        time.sleep(self.add_delay)
+        return True, 'added', self.store(file_location, file_name, container)['vault_id']
+
+    def vault_info(self, vault_id=None, container_id=None, file_name=None):
+        with self._lock:
+            if vault_id is not None:
+                items = [item for item in self.items if item['vault_id'] == vault_id]
+            else:
+                items = [item for item in self.items if item['container'] == container_id]
+        return bool(items) or container_id is not None, 'ok', items
+
+
+@pytest.fixture
+def vault(tmp_path, monkeypatch):
+    vault_dir = tmp_path / 'vault'
+    vault_tmp_dir = tmp_path / 'vault_tmp'
+    vault_dir.mkdir()
+    vault_tmp_dir.mkdir()
+
+    fake_vault = FakeVault(str(vault_dir))
+    monkeypatch.setattr(phantom_connector.ph_rules, 'vault_add', fake_vault.vault_add, raising=False)
+    monkeypatch.setattr(phantom_connector.ph_rules, 'vault_info', fake_vault.vault_info, raising=False)
+    monkeypatch.setattr(phantom_connector.PhantomConnector, '_get_vault_tmp_dir', staticmethod(lambda: str(vault_tmp_dir)))
+    fake_vault.tmp_dir = str(vault_tmp_dir)
+    return fake_vault
+
+
+def run_deflate_item(vault, tmp_path, archive_name, archive_data, config=None, **param):
+    archive_path = tmp_path / archive_name
+    archive_path.write_bytes(archive_data)
+    item = vault.store(str(archive_path), archive_name)
+
+    connector = phantom_connector.PhantomConnector()
+    connector.get_config = lambda: dict({'phantom_server': '10.1.1.10'}, **(config or {}))
+    connector.get_action_identifier = lambda: 'deflate_item'
+    connector.get_container_id = lambda: 1
+    connector.load_state = lambda: {}
+    connector.save_state = lambda state: None
+    assert connector.initialize()
+
+    connector.handle_action(dict({'vault_id': item['vault_id'], 'container_id': 1}, **param))
+    connector.finalize()
+    return connector.get_action_results()[0]
+
+
+def test_gzip_starting_with_a_zero_block_is_not_a_tarball(vault, tmp_path):
+    # tarfile reads a leading zero block as the end of an empty archive
+    data = b'\0' * 32768 + b'disk image contents'
+    action_result = run_deflate_item(vault, tmp_path, 'disk.img.gz', gzip.compress(data))
+
+    assert action_result.get_status()
+    vaulted = [item for item in vault.items if item['container'] == 1]
+    assert [item['name'] for item in vaulted] == ['disk.img']
+    with open(vaulted[0]['path'], 'rb') as f:
+        assert f.read() == data
+
+
+def test_compressed_tarball_is_extracted_in_one_pass(vault, tmp_path):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+        for name in ('one.txt', 'two.txt'):
+            info = tarfile.TarInfo(name)
+            info.size = len(name)
+            tar.addfile(info, io.BytesIO(name.encode()))
+
+    action_result = run_deflate_item(vault, tmp_path, 'files.tar.gz', buf.getvalue())
+
+    assert action_result.get_status()
+    assert sorted(item['name'] for item in vault.items if item['container'] == 1) == ['one.txt', 'two.txt']
+
+
+def test_exceeded_budget_with_workers_reports_every_vaulted_file(vault, tmp_path):
+    # The first member exceeds the byte budget while the workers of the next members are adding them to the vault
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as archive:
+        archive.writestr('member00.bin', os.urandom(4 * 1024 * 1024))
+        for i in range(1, 12):
+            archive.writestr('member{0:02d}.txt'.format(i), 'member {0}'.format(i) * 100)
+    vault.add_delay = 0.2
+
+    action_result = run_deflate_item(vault, tmp_path, 'members.zip', buf.getvalue(),
+                                     config={'deflate_workers': 4, 'deflate_max_bytes': 1024 * 1024})
+
+    assert not action_result.get_status()
+    assert 'budget_exceeded' in action_result.get_summary()
+    vaulted = sorted(item['vault_id'] for item in vault.items if item['container'] == 1)
+    reported = sorted(data['vault_id'] for data in action_result.get_data())
+    assert vaulted == reported
+    assert action_result.get_summary()['total_vault_items'] == len(vaulted)
+    assert os.listdir(vault.tmp_dir) == []